@@ -0,0 +1,154 @@
+// metric and smoothing transforms of the country grid, applied in the browser when the app
+// runs with COVID_APP_CLIENTSIDE=1. the functions mirror metrics.py and are looked up by the
+// python function names sent in the country-series store.
+(function () {
+    var daily = {
+        // difference to the previous day, the first day is 0
+        daily_values: function (cumulative) {
+            return cumulative.map(function (value, i) {
+                return i === 0 ? 0 : value - cumulative[i - 1];
+            });
+        },
+        // absolute change between reports, the first report counts in full
+        abs_daily_values: function (cumulative) {
+            return cumulative.map(function (value, i) {
+                return Math.abs(i === 0 ? value : value - cumulative[i - 1]);
+            });
+        },
+        // a drop of the total is a day without change
+        clipped_daily_values: function (cumulative) {
+            return daily.daily_values(cumulative).map(function (value) {
+                return Math.max(value, 0);
+            });
+        },
+        // a drop of the total is taken back from the days before it
+        spread_daily_values: function (cumulative) {
+            var capped = cumulative.slice();
+            for (var i = capped.length - 2; i >= 0; i--) {
+                capped[i] = Math.min(capped[i], capped[i + 1]);
+            }
+            return daily.daily_values(capped);
+        }
+    };
+
+    // mean of the window ending on each day, nan until a full window is available and
+    // for every window that contains a nan day
+    function trailingMean(values, size) {
+        var total = [], gaps = [], sum = 0, missing = 0;
+        values.forEach(function (value) {
+            if (value === null || isNaN(value)) {
+                missing += 1;
+            } else {
+                sum += value;
+            }
+            total.push(sum);
+            gaps.push(missing);
+        });
+        return total.map(function (sum, i) {
+            if (i < size - 1 || gaps[i] - (i === size - 1 ? 0 : gaps[i - size]) > 0) {
+                return NaN;
+            }
+            return (i === size - 1 ? sum : sum - total[i - size]) / size;
+        });
+    }
+
+    var smooth = {
+        trailing: trailingMean,
+        // mean of the window around each day
+        centered: function (values, size) {
+            var trailing = trailingMean(values, size);
+            var shift = Math.floor((size - 1) / 2);
+            return trailing.map(function (value, i) {
+                return i + shift < trailing.length ? trailing[i + shift] : NaN;
+            });
+        },
+        // exponentially weighted mean with span size, nan days keep the previous value
+        ewma: function (values, size) {
+            var alpha = 2 / (size + 1);
+            var last = NaN;
+            return values.map(function (value) {
+                if (value !== null && !isNaN(value)) {
+                    last = isNaN(last) ? value : alpha * value + (1 - alpha) * last;
+                }
+                return last;
+            });
+        }
+    };
+
+    // metrics registered in metrics.py need a counterpart here
+    var metrics = {
+        'Cumulative': function (cumulative, values, population) {
+            return cumulative;
+        },
+        'Daily': function (cumulative, values, population) {
+            return values;
+        },
+        'Cumulative Per Capita': function (cumulative, values, population) {
+            return perCapita(cumulative, population);
+        },
+        'Daily Per Capita': function (cumulative, values, population) {
+            return perCapita(values, population);
+        }
+    };
+
+    function perCapita(values, population) {
+        return values.map(function (value) {
+            return population === null ? NaN : value / population * 100;
+        });
+    }
+
+    // date of a day on a chart axis, the axis holds either every date or x0 / dx
+    function dayOf(axis, day) {
+        return axis.x ? axis.x[day] : new Date(Date.parse(axis.x0) + day * axis.dx).toISOString().slice(0, 10);
+    }
+
+    // markers on the flagged days of the selected countries, like flag_trace in vaccine_app.py
+    function flagTrace(chart, traces, type) {
+        return {
+            type: type,
+            x: chart.flags.map(function (flag) { return dayOf(chart.axis, flag[1]); }),
+            y: chart.flags.map(function (flag) { return traces[flag[0]].y[flag[1]]; }),
+            text: chart.flags.map(function (flag) { return traces[flag[0]].name + ': ' + flag[2]; }),
+            mode: 'markers',
+            marker: {symbol: 'x', size: 7, color: '#ff6f61'},
+            hovertemplate: '%{text}<extra></extra>',
+            name: 'flagged',
+            showlegend: false
+        };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        clientside: {
+            countryGrid: function (store, metric, smoothing) {
+                if (!store) {
+                    throw window.dash_clientside.PreventUpdate;
+                }
+                var size = store.smoothing[smoothing][0];
+                var method = store.smoothing[smoothing][1];
+                return store.charts.map(function (chart) {
+                    var traces = chart.series.map(function (cumulative, i) {
+                        var values = metrics[metric](cumulative, daily[chart.daily](cumulative), store.population[i]);
+                        var trace = Object.assign({type: store.trace_type}, chart.axis);
+                        trace.y = size === 1 ? values : smooth[method](values, size);
+                        if (!store.known[i]) {
+                            // unknown countries get a row of zeros whatever the metric and smoothing, like metric_rows
+                            trace.y = trace.y.map(function () { return 0; });
+                        }
+                        trace.mode = 'lines';
+                        trace.opacity = 0.7;
+                        trace.name = store.countries[i];
+                        trace.textposition = 'bottom center';
+                        return trace;
+                    });
+                    if (chart.flags.length) {
+                        traces.push(flagTrace(chart, traces, store.trace_type));
+                    }
+                    return {
+                        data: traces,
+                        layout: Object.assign({}, store.layout, {title: {text: chart.title, font: {size: 12}}})
+                    };
+                });
+            }
+        }
+    });
+})();
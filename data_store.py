@@ -0,0 +1,257 @@
+### local snapshot store for the remote csv sources
+# every source is kept as a parquet file next to a manifest.json so the app
+# can start without downloading anything. run `python data_store.py` to refresh.
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from fetcher import fetch_sources, format_report
+from schemas import SCHEMAS, read_columns, read_source
+
+JHU_URL = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19'
+GOVEX_URL = 'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables/vaccine_data/global_data'
+
+# source name -> remote csv
+SOURCES = {
+    'deaths': JHU_URL + '/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv',
+    'confirmed': JHU_URL + '/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv',
+    'country': JHU_URL + '/web-data/data/cases_country.csv',
+    'country_vax': GOVEX_URL + '/vaccine_data_global.csv',
+    'global_vax_full': GOVEX_URL + '/time_series_covid19_vaccine_global.csv',
+}
+
+SNAPSHOT_DIR = os.environ.get('COVID_APP_SNAPSHOT_DIR', os.path.join('data', 'snapshots'))
+# serve the sources from another host with the same file names, e.g. a local stand-in server
+SOURCE_BASE_URL = os.environ.get('COVID_APP_SOURCE_BASE')
+# directory holding csv files named like the remote ones, used instead of the network in offline mode
+FIXTURE_DIR = os.environ.get('COVID_APP_FIXTURE_DIR')
+MANIFEST_FILE = 'manifest.json'
+# a manifest lock older than this is treated as left behind by a dead process
+MANIFEST_LOCK_TIMEOUT = 60
+# JHU wide files, one column per date, their snapshots are extended with the new dates only
+WIDE_SOURCES = ['deaths', 'confirmed']
+
+
+def is_offline():
+    return '--offline' in sys.argv or os.environ.get('COVID_APP_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def source_filename(name):
+    return SOURCES[name].rsplit('/', 1)[-1]
+
+
+def source_url(name):
+    if SOURCE_BASE_URL:
+        return SOURCE_BASE_URL.rstrip('/') + '/' + source_filename(name)
+    return SOURCES[name]
+
+
+def snapshot_path(name, snapshot_dir=None):
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, name + '.parquet')
+
+
+### manifest
+def read_manifest(snapshot_dir=None):
+    path = os.path.join(snapshot_dir or SNAPSHOT_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def tmp_path(path):
+    # temp file next to path, unique per process and thread so concurrent writers never share one
+    return '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+
+
+def write_manifest(manifest, snapshot_dir=None):
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    tmp = tmp_path(path)
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _acquire_manifest_lock(snapshot_dir):
+    # blocks until this thread holds the lock file of the manifest
+    path = os.path.join(snapshot_dir, MANIFEST_FILE + '.lock')
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > MANIFEST_LOCK_TIMEOUT:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.01)
+
+
+def update_manifest(name, info, snapshot_dir=None):
+    # merge info into the entry of name, the read-modify-write runs under the manifest lock
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    os.makedirs(snapshot_dir, exist_ok=True)
+    lock = _acquire_manifest_lock(snapshot_dir)
+    try:
+        manifest = read_manifest(snapshot_dir)
+        manifest.setdefault(name, {}).update(info)
+        write_manifest(manifest, snapshot_dir)
+    finally:
+        try:
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
+
+
+### snapshots
+def write_snapshot(name, df, snapshot_dir=None, **info):
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = snapshot_path(name, snapshot_dir)
+    # write next to the target and rename so readers never see a partial file
+    tmp = tmp_path(path)
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+    update_manifest(name, dict(info,
+                               url=source_url(name),
+                               file=os.path.basename(path),
+                               rows=int(df.shape[0]),
+                               columns=int(df.shape[1]),
+                               written_at=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")), snapshot_dir)
+
+
+def read_snapshot(name, snapshot_dir=None):
+    # snapshots written before the schemas may hold more columns
+    return pd.read_parquet(snapshot_path(name, snapshot_dir), columns=SCHEMAS[name].columns)
+
+
+def has_snapshot(name, snapshot_dir=None):
+    return name in read_manifest(snapshot_dir) and os.path.exists(snapshot_path(name, snapshot_dir))
+
+
+def fixture_path(name, fixture_dir=None):
+    fixture_dir = fixture_dir or FIXTURE_DIR
+    if not fixture_dir:
+        raise RuntimeError("no snapshot for '%s' and COVID_APP_FIXTURE_DIR is not set" % name)
+    return os.path.join(fixture_dir, source_filename(name))
+
+
+def read_fixture(name, fixture_dir=None):
+    return read_source(name, fixture_path(name, fixture_dir))
+
+
+### append-only ingestion of the wide files
+# a new download of a wide file is compared with the snapshot row by row: the text before the
+# new date columns must match the checksum stored in the manifest, then only the new columns
+# are parsed and appended. revised history, new rows or reordered columns parse the whole file.
+def checksum(rows):
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(row)
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def ingest_wide(name, content, stored=None, stored_checksum=None):
+    # returns the frame and the manifest info of the ingestion
+    lines = [line for line in content.splitlines() if line]
+    header, rows = next(csv.reader([lines[0].decode()])), lines[1:]
+    if (stored is not None and stored_checksum and len(rows) == len(stored)
+            and header[:stored.shape[1]] == list(stored.columns)):
+        n_new = len(header) - stored.shape[1]
+        # date values are never quoted, the new fields can be split off from the right
+        parts = [row.rsplit(b',', n_new) for row in rows] if n_new else [[row] for row in rows]
+        if all(len(part) == n_new + 1 for part in parts) and checksum(part[0] for part in parts) == stored_checksum:
+            frame = stored
+            if n_new:
+                new = b'\n'.join([','.join(header[-n_new:]).encode()] + [b','.join(part[1:]) for part in parts])
+                frame = pd.concat([stored, read_columns(name, io.BytesIO(new))], axis=1)
+            return frame, {'ingest': 'append', 'parsed_columns': n_new, 'checksum': checksum(rows)}
+    frame = read_source(name, content)
+    return frame, {'ingest': 'full', 'parsed_columns': int(frame.shape[1]), 'checksum': checksum(rows)}
+
+
+def parse_source(name, content, snapshot_dir=None):
+    # frame and manifest info of a downloaded csv
+    if name not in WIDE_SOURCES:
+        return read_source(name, content), {}
+    stored_checksum = read_manifest(snapshot_dir).get(name, {}).get('checksum')
+    stored = read_snapshot(name, snapshot_dir) if stored_checksum and has_snapshot(name, snapshot_dir) else None
+    return ingest_wide(name, content, stored, stored_checksum)
+
+
+### loading
+def refresh_snapshots(names=None, snapshot_dir=None):
+    # download the sources that changed since the last snapshot and replace their snapshots,
+    # unchanged (304) sources are read back from the store
+    names = names or list(SOURCES)
+    manifest = read_manifest(snapshot_dir)
+    validators = {name: manifest[name] for name in names if has_snapshot(name, snapshot_dir)}
+    # manifest info of the parsed sources, filled in by the fetch threads
+    ingested = {}
+
+    def parser(name):
+        def parse(content):
+            frame, ingested[name] = parse_source(name, content, snapshot_dir)
+            return frame
+        return parse
+
+    results = fetch_sources({name: source_url(name) for name in names}, validators,
+                            parsers={name: parser(name) for name in names})
+
+    frames = {}
+    checked_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    for name, result in results.items():
+        info = {'etag': result.etag, 'last_modified': result.last_modified, 'checked_at': checked_at,
+                'fetch_bytes': result.nbytes, 'fetch_seconds': round(result.seconds, 3)}
+        if result.frame is None:
+            frames[name] = read_snapshot(name, snapshot_dir)
+            update_manifest(name, info, snapshot_dir)
+        else:
+            frames[name] = result.frame
+            info.update(ingested.get(name, {}))
+            write_snapshot(name, result.frame, snapshot_dir, **info)
+    return frames, results
+
+
+def load_sources(snapshot_dir=None, offline=None):
+    # snapshot first. missing snapshots come from the fixture dir in offline mode,
+    # otherwise they are downloaded once and written to the store
+    offline = is_offline() if offline is None else offline
+    frames = {}
+    missing = []
+    for name in SOURCES:
+        if has_snapshot(name, snapshot_dir):
+            frames[name] = read_snapshot(name, snapshot_dir)
+        elif offline:
+            frames[name] = read_fixture(name)
+        else:
+            missing.append(name)
+    if missing:
+        frames.update(refresh_snapshots(missing, snapshot_dir)[0])
+    return frames
+
+
+if __name__ == "__main__":
+    if is_offline():
+        # seed the snapshot store from fixture files
+        for source in SOURCES:
+            with open(fixture_path(source), 'rb') as f:
+                frame, info = parse_source(source, f.read())
+            write_snapshot(source, frame, **info)
+    else:
+        print(format_report(refresh_snapshots()[1]))
+    print(json.dumps(read_manifest(), indent=2, sort_keys=True))
@@ -0,0 +1,778 @@
+### versioned, immutable dataset behind the dashboard
+# the whole cleaned dataset is rebuilt off the request path and swapped in with one
+# reference assignment. callbacks grab current_dataset() once and only read from it,
+# so they always see a consistent version even while a refresh is running.
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from datetime import datetime
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+from data_store import is_offline, load_sources, read_manifest, refresh_snapshots
+from forecast import country_forecast, get_model, prune_models, start_pool
+from metrics import NO_SMOOTHING, REVISION_POLICY, SERIES, build_metric_table, build_world_table, metric_row
+from quality import REPAIR, check_series, quality_report, repair
+from schemas import GOVEX_COLUMNS, read_source
+
+POPULATION_CSV = os.path.join('data', 'population_by_country_2020.csv')
+# continent of each country name used by the JHU and GovEx files
+REGIONS_CSV = os.path.join('data', 'country_regions.csv')
+# countries selected when the page opens, their forecasts are computed with every new version
+DEFAULT_COUNTRIES = ['US', 'China', 'Brazil', 'India']
+# seconds between background refreshes, 0 disables the refresher
+REFRESH_SECONDS = int(os.environ.get('COVID_APP_REFRESH_SECONDS', 3 * 60 * 60))
+# processed datasets are written here once and memory-mapped by every worker
+DATASET_DIR = os.environ.get('COVID_APP_DATASET_DIR', os.path.join('data', 'datasets'))
+# dataset directories kept on disk, workers may still map the previous one
+KEEP_DATASETS = int(os.environ.get('COVID_APP_KEEP_DATASETS', 2))
+# a build lock older than this is treated as left behind by a dead worker, the others check
+# for the dataset it builds every BUILD_POLL_SECONDS
+BUILD_LOCK_TIMEOUT = 15 * 60
+BUILD_POLL_SECONDS = 0.5
+# settings changing what a build produces, part of its build id and of the figure cache version
+PIPELINE_SETTINGS = REVISION_POLICY + ('-repaired' if REPAIR else '')
+# names the bundle published by the build step, see build_bundle()
+CURRENT_FILE = 'CURRENT'
+# names the data version of the last background refresh, the other workers follow it
+LATEST_FILE = 'LATEST'
+# one worker at a time refreshes the snapshot store, see refresh_dataset()
+REFRESH_LOCK = 'refresh'
+BUNDLE_MANIFEST = 'manifest.json'
+# array fields stored as .npy files and mapped read-only, the small fields are pickled
+MAPPED_FIELDS = ['case_cube', 'death_cube', 'dose_cube', 'fullvax_cube', 'population', 'val', 'vax_x_data']
+# cube -> the dates of its columns
+CUBE_DATES = {'case_cube': 'case_x_data', 'death_cube': 'death_x_data', 'dose_cube': 'vax_x_data',
+              'fullvax_cube': 'vax_x_data'}
+TOTAL_FIELDS = ['confirmed_total', 'deaths_total', 'recovered_total', 'active_total', 'doses_admin_total',
+                'full_vax_total']
+# columns kept from the country and world frames
+FULL_COUNTRY_COLUMNS = ['country', 'lat', 'long_', 'confirmed', 'deaths', 'Doses_admin', 'People_partially_vaccinated',
+                        'People_fully_vaccinated', 'Percent_fully_vaccinated']
+WORLD_VAX_COLUMNS = ['Date', 'Doses_admin', 'People_fully_vaccinated', 'Percent_fully_vaccinated']
+# dataselect columns of full_country_df with a precomputed ranking
+RANK_COLUMNS = ['Doses_admin', 'People_fully_vaccinated', 'Percent_fully_vaccinated', 'confirmed', 'deaths']
+
+
+@dataclass(frozen=True, eq=False)
+class Dataset:
+    version: str
+    built_at: str
+    update: str
+    # only the columns the charts read, the raw source frames are not kept
+    full_country_df: pd.DataFrame
+    # dataselect column -> full_country_df positions ordered from the highest value
+    rank_index: dict
+    world_vax_ts: pd.DataFrame
+    country_list: pd.DataFrame
+    # region -> country_list countries, for the select region shortcut
+    regions: dict
+    case_x_data: pd.DatetimeIndex
+    death_x_data: pd.DatetimeIndex
+    vax_x_data: np.ndarray
+    # dense [country, date] arrays, rows looked up through country_index
+    country_index: dict
+    population: np.ndarray
+    case_cube: np.ndarray
+    death_cube: np.ndarray
+    dose_cube: np.ndarray
+    fullvax_cube: np.ndarray
+    # (series, metric, smoothing) -> [country, date] array, see metrics.py
+    metric_table: dict
+    # (series, metric, smoothing) -> world 1d array, see metrics.py
+    world_table: dict
+    # series -> 'negative' | 'outlier' -> (country row, day) pairs, see quality.py
+    flags: dict
+    # per-country flag counts and days since each series last changed
+    quality: pd.DataFrame
+    # world percent fully vaccinated, the series behind the forecast model
+    val: np.ndarray
+    confirmed_total: int
+    deaths_total: int
+    recovered_total: int
+    active_total: int
+    doses_admin_total: int
+    full_vax_total: int
+
+
+def data_version(sources):
+    # content hash of the raw sources, identical data gives the same version in every worker
+    digest = hashlib.sha1()
+    for name in sorted(sources):
+        digest.update(name.encode())
+        digest.update(pd.util.hash_pandas_object(sources[name], index=False).values.tobytes())
+    return digest.hexdigest()[:12]
+
+
+### dense country x date cubes
+def int_dtype(values):
+    # smallest integer type holding the counts and their negative daily changes
+    if values.size == 0:
+        return np.int8
+    bound = max(abs(np.nanmin(values)), abs(np.nanmax(values)))
+    return next(dtype for dtype in (np.int8, np.int16, np.int32, np.int64) if bound <= np.iinfo(dtype).max)
+
+
+def wide_cube(wide_df, countries):
+    # sum the province rows of a JHU wide file into one row per country
+    values = wide_df.groupby('country', observed=True)[list(wide_df.columns[20:])].sum()
+    values = values.reindex(pd.Index(countries), fill_value=0).to_numpy()
+    return values.astype(int_dtype(values))
+
+
+def long_cube(long_df, column, countries, dates):
+    # pivot a GovEx long file to [country, date], carrying the last reported total over missing days
+    values = long_df.groupby(['country', 'Date'], observed=True)[column].max().unstack('Date')
+    values = values.reindex(index=countries, columns=dates).ffill(axis=1).fillna(0).to_numpy()
+    return values.astype(int_dtype(values))
+
+
+def build_dataset(sources, version=None):
+    version = version or data_version(sources)
+    death_df = sources['deaths'].copy()
+    confirmed_df = sources['confirmed'].copy()
+    country_df = sources['country'].copy()
+    country_vax_df = sources['country_vax']
+    # the GovEx time series without the columns nothing reads
+    global_vax_full_df = sources['global_vax_full'][GOVEX_COLUMNS]
+
+    ### load population data from local csv
+    pop_raw = read_source('population', POPULATION_CSV)
+
+    ### data cleaning
+    # renaming the df column names to lowercase
+    country_df.columns = map(str.lower, country_df.columns)
+    confirmed_df.columns = map(str.lower, confirmed_df.columns)
+    death_df.columns = map(str.lower, death_df.columns)
+
+    # changing province/state to state and country/region to country
+    confirmed_df = confirmed_df.rename(columns={'province/state': 'state', 'country/region': 'country'})
+    death_df = death_df.rename(columns={'province/state': 'state', 'country/region': 'country'})
+    country_df = country_df.rename(columns={'country_region': 'country'})
+
+    country_vax_df = country_vax_df.rename(columns={'Province_State': 'state', 'Country_Region': 'country'})
+    global_vax_full_df = global_vax_full_df.rename(columns={'Province_State': 'state', 'Country_Region': 'country'})
+
+    # repeated names as categoricals
+    for df in (confirmed_df, death_df):
+        df[['state', 'country']] = df[['state', 'country']].astype('category')
+    global_vax_full_df['country'] = global_vax_full_df['country'].astype('category')
+
+    # merge & drop duplicates to get lat & long for each country vax data
+    full_country_df = pd.merge(country_df, country_vax_df, on='country')
+    full_country_df = full_country_df.drop_duplicates(subset=['country'])
+    full_country_df['People_fully_vaccinated'] = full_country_df['People_fully_vaccinated'].fillna(0)
+
+    ### dataframe has country data as well as that country split into states
+    # drop the ones with states
+    global_vax_full_df = global_vax_full_df.drop(global_vax_full_df[pd.notna(global_vax_full_df['state'])].index)
+
+    # world vax data time series
+    world_vax_ts = global_vax_full_df[global_vax_full_df['country'] == 'World'].copy()
+    # the dates are categoricals in the source frame, the charts get plain strings
+    world_vax_ts['Date'] = world_vax_ts['Date'].astype(str)
+
+    # population data
+    pop_raw = pop_raw.rename(columns={"Country(or dependency)": "country", "Population(2020)": "population"})
+    pop = pop_raw[['country', 'population']]
+    global_vax_full_df = pd.merge(global_vax_full_df, pop, on='country', how='left')
+
+    full_country_df = pd.merge(full_country_df, pop, on='country', how='left')
+    full_country_df['Percent_fully_vaccinated'] = (
+            full_country_df['People_fully_vaccinated'] / full_country_df['population'])
+    full_country_df['Percent_fully_vaccinated'] = full_country_df['Percent_fully_vaccinated'].fillna(0)
+
+    ### daily data
+    # the daily changes of every country and the world are derived from the cubes in one batched
+    # pass per series, see metrics.SERIES and COVID_APP_REVISION_POLICY
+    world_vax_ts['Percent_fully_vaccinated'] = world_vax_ts['People_fully_vaccinated'] / pop['population'].sum()
+
+    ### world ARIMA modeling % vax
+    # the model itself is loaded or fitted lazily, see forecast.py
+    val = world_vax_ts['Percent_fully_vaccinated'].values
+
+    # last update
+    u1 = country_df.iloc[0]['last_update']
+    u2 = datetime.strptime(u1, "%Y-%m-%d %H:%M:%S")
+    update = datetime.strftime(u2, "%b %d %Y %H:%M:%S")
+
+    # clean country list
+    country_list = country_vax_df.drop(country_vax_df[pd.notna(country_vax_df['state'])].index)
+    country_list = country_list[country_list['country'] != 'World']
+    country_list = country_list[country_list['country'] != 'Kosovo']
+    country_list = country_list[country_list['country'] != 'US (Aggregate)']
+
+    world_vax = country_vax_df.loc[country_vax_df['country'] == 'World']
+
+    # group the dropdown countries by region
+    region_of = pd.read_csv(REGIONS_CSV).set_index('country')['region'].to_dict()
+    regions = {}
+    for country in country_list['country'].unique():
+        if country in region_of:
+            regions.setdefault(region_of[country], []).append(country)
+
+    ### country cubes
+    countries = sorted(set(confirmed_df['country']) | set(death_df['country']) | set(global_vax_full_df['country']))
+    vax_dates = sorted(global_vax_full_df['Date'].unique())
+    population = pop.drop_duplicates(subset=['country']).set_index('country')['population']
+    population = population.reindex(countries).to_numpy(dtype=float)
+    cubes = {'cases': wide_cube(confirmed_df, countries),
+             'deaths': wide_cube(death_df, countries),
+             'doses': long_cube(global_vax_full_df, 'Doses_admin', countries, vax_dates),
+             'fullvax': long_cube(global_vax_full_df, 'People_fully_vaccinated', countries, vax_dates)}
+
+    ### quality checks
+    # on the data as reported, with COVID_APP_REPAIR=1 the charts get the repaired cubes
+    flags = check_series(cubes)
+    quality = quality_report(flags, cubes, countries)
+    if REPAIR:
+        cubes = {series: repair(cube, flags[series]) for series, cube in cubes.items()}
+
+    return Dataset(
+        version=version,
+        built_at=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        update=update,
+        full_country_df=full_country_df[FULL_COUNTRY_COLUMNS].reset_index(drop=True),
+        rank_index=build_rank_index(full_country_df),
+        world_vax_ts=world_vax_ts[WORLD_VAX_COLUMNS].reset_index(drop=True),
+        country_list=country_list[['country']].reset_index(drop=True),
+        regions={region: regions[region] for region in sorted(regions)},
+        # dates of the JHU wide files
+        case_x_data=pd.to_datetime(confirmed_df.iloc[:, 20:].columns),
+        death_x_data=pd.to_datetime(death_df.iloc[:, 20:].columns),
+        # GovEx dates are kept as the reported 'YYYY-MM-DD' strings
+        vax_x_data=np.array(vax_dates),
+        country_index={country: i for i, country in enumerate(countries)},
+        population=population,
+        case_cube=cubes['cases'],
+        death_cube=cubes['deaths'],
+        dose_cube=cubes['doses'],
+        fullvax_cube=cubes['fullvax'],
+        metric_table=build_metric_table(cubes, population),
+        flags=flags,
+        quality=quality,
+        world_table=build_world_table({
+            # int64, the world totals overflow the int32 cubes
+            'cases': cubes['cases'].sum(axis=0, dtype=np.int64),
+            'deaths': cubes['deaths'].sum(axis=0, dtype=np.int64),
+            # the GovEx 'World' rows
+            'doses': world_vax_ts['Doses_admin'].to_numpy(),
+            'fullvax': world_vax_ts['People_fully_vaccinated'].to_numpy(),
+            'percentvax': world_vax_ts['Percent_fully_vaccinated'].to_numpy(),
+        }),
+        val=val,
+        # total number of confirmed, death and recovered cases
+        confirmed_total=int(country_df['confirmed'].sum()),
+        deaths_total=int(country_df['deaths'].sum()),
+        recovered_total=int(country_df['recovered'].sum()),
+        active_total=int(country_df['active'].sum()),
+        doses_admin_total=int(world_vax['Doses_admin'].iloc[0]),
+        full_vax_total=int(world_vax['People_fully_vaccinated'].iloc[0]),
+    )
+
+
+### per-version memoization
+def version_cache(maxsize=16):
+    # lru_cache for functions of a dataset, keyed on ds.version rather than on the dataset so the cache
+    # does not keep superseded datasets and their memory maps alive. results must not reference the dataset
+    def decorator(fn):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(fn)
+        def wrapper(ds, *args):
+            key = (ds.version,) + args
+            with lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    return cache[key]
+            value = fn(ds, *args)
+            with lock:
+                cache[key] = value
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return value
+        return wrapper
+    return decorator
+
+
+### country rankings
+def build_rank_index(full_country_df):
+    # same order as full_country_df.sort_values(column, ascending=False), missing values last
+    positions = full_country_df.reset_index(drop=True)
+    return {column: positions.sort_values(column, ascending=False).index.to_numpy() for column in RANK_COLUMNS}
+
+
+@version_cache()
+def top_countries(ds, column, n):
+    # first n rows of full_country_df by column, shared by the callbacks that fire on the same inputs
+    return ds.full_country_df.iloc[ds.rank_index[column][:n]]
+
+
+### country populations
+def country_population(ds, country):
+    i = ds.country_index.get(country)
+    return np.nan if i is None else ds.population[i]
+
+
+### memory accounting
+def nbytes(value, seen):
+    # deep size of a field, containers already in seen are not counted again
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index, np.ndarray, dict, list, tuple)):
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        # pages of a mapped file are shared by the workers, memory_report() lists them apart
+        return 0 if is_mapped(value) else value.nbytes
+    if isinstance(value, dict):
+        return sum(nbytes(key, seen) + nbytes(item, seen) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item, seen) for item in value)
+    return sys.getsizeof(value)
+
+
+def is_mapped(values):
+    return isinstance(values, np.memmap) and values.filename is not None
+
+
+def memory_report(ds):
+    # private bytes per dataset field, largest first. arrays shared by two fields count for the first one
+    seen = set()
+    sizes = {field.name: nbytes(getattr(ds, field.name), seen) for field in fields(ds)}
+    arrays = [getattr(ds, field) for field in MAPPED_FIELDS] + list(ds.metric_table.values())
+    mapped = {id(values): values.nbytes for values in arrays if is_mapped(values)}
+    return {'version': ds.version,
+            'total': sum(sizes.values()),
+            'mapped': sum(mapped.values()),
+            'fields': dict(sorted(sizes.items(), key=lambda item: -item[1]))}
+
+
+### shared dataset files
+# the unsmoothed metric table and the cubes are mapped, so workers on one machine share their
+# pages instead of each holding a private copy. smoothed variants are still computed per worker.
+def build_id():
+    # fingerprint of the pipeline code and its settings, a changed build never maps files written by the old one
+    digest = hashlib.sha1()
+    for name in ('dataset.py', 'metrics.py', 'quality.py'):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+            digest.update(f.read())
+    digest.update(PIPELINE_SETTINGS.encode())
+    return digest.hexdigest()[:8]
+
+
+BUILD_ID = build_id()
+
+
+def dataset_path(version, directory=None):
+    return os.path.join(directory or DATASET_DIR, '%s-%s' % (version, BUILD_ID))
+
+
+def save_dataset(ds, directory=None):
+    path = dataset_path(ds.version, directory)
+    if os.path.isdir(path):
+        return path
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    # id of an array -> file name, an array referenced twice (a cube is also its Cumulative entry) is written once
+    files = {}
+
+    def store(name, values):
+        if id(values) not in files:
+            np.save(os.path.join(tmp, name + '.npy'), values)
+            files[id(values)] = name
+        return files[id(values)]
+
+    mapped = {field: store(field, getattr(ds, field)) for field in MAPPED_FIELDS}
+    table = {key: store('-'.join(key).replace(' ', '_'), values)
+             for key, values in ds.metric_table.items() if key[2] == NO_SMOOTHING}
+    small = {field.name: getattr(ds, field.name) for field in fields(ds)
+             if field.name not in MAPPED_FIELDS and field.name != 'metric_table'}
+    with open(os.path.join(tmp, 'dataset.pkl'), 'wb') as f:
+        pickle.dump({'fields': small, 'mapped': mapped, 'metric_table': table}, f)
+    with open(os.path.join(tmp, BUNDLE_MANIFEST), 'w') as f:
+        json.dump(bundle_manifest(ds, tmp), f, indent=2, sort_keys=True)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # another worker finished the same version first
+        shutil.rmtree(tmp, ignore_errors=True)
+    prune_datasets(directory)
+    return path
+
+
+def map_dataset(version, directory=None):
+    # the dataset of this version with its arrays mapped read-only, None when it was not written yet
+    path = dataset_path(version, directory)
+    if not os.path.isdir(path):
+        return None
+    return map_bundle(path)
+
+
+def map_bundle(path):
+    with open(os.path.join(path, 'dataset.pkl'), 'rb') as f:
+        saved = pickle.load(f)
+    arrays = {}
+
+    def load(name):
+        if name not in arrays:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        return arrays[name]
+
+    return Dataset(**saved['fields'],
+                   **{field: load(name) for field, name in saved['mapped'].items()},
+                   metric_table={key: load(name) for key, name in saved['metric_table'].items()})
+
+
+def prune_datasets(directory=None):
+    directory = directory or DATASET_DIR
+    paths = [os.path.join(directory, name) for name in os.listdir(directory)
+             if not name.endswith('.tmp') and os.path.isdir(os.path.join(directory, name))]
+    current = current_bundle(directory)
+    # files still mapped by a worker stay readable after they are removed
+    for path in sorted(paths, key=os.path.getmtime)[:-KEEP_DATASETS]:
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _acquire_build_lock(path):
+    # the lock file of a dataset directory, None while another worker holds it
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock = path + '.lock'
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return lock
+    except FileExistsError:
+        # the holder may remove the lock between the create and these checks, then try again
+        try:
+            if time.time() - os.path.getmtime(lock) <= BUILD_LOCK_TIMEOUT:
+                return None
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
+        return _acquire_build_lock(path)
+
+
+def _release_build_lock(lock):
+    # a holder slower than BUILD_LOCK_TIMEOUT may find its lock already removed as stale
+    try:
+        os.remove(lock)
+    except FileNotFoundError:
+        pass
+
+
+def shared_dataset(sources, version=None):
+    # map the processed dataset of this version. the first worker to need it builds and writes it
+    # under a lock file, the others wait for its directory and map it
+    version = version or data_version(sources)
+    path = dataset_path(version)
+    while True:
+        ds = map_dataset(version)
+        if ds is not None:
+            return ds
+        try:
+            lock = _acquire_build_lock(path)
+        except OSError as e:
+            print('dataset not shared: %r' % e)
+            return build_dataset(sources, version)
+        if lock is not None:
+            break
+        time.sleep(BUILD_POLL_SECONDS)
+    try:
+        # it may have been written between the map and the lock
+        ds = map_dataset(version)
+        if ds is not None:
+            return ds
+        ds = build_dataset(sources, version)
+        try:
+            save_dataset(ds)
+        except OSError as e:
+            print('dataset not shared: %r' % e)
+            return ds
+    finally:
+        _release_build_lock(lock)
+    return map_dataset(version)
+
+
+### offline build step
+# `python -m vaccine_app build` runs the whole pipeline once and publishes its bundle, the
+# dataset directory plus a manifest. web processes then only map the published bundle and
+# follow the pointer when a later build publishes a new one.
+def date_range(dates):
+    dates = pd.Index(dates).astype(str)
+    return [dates[0], dates[-1]] if len(dates) else []
+
+
+def bundle_manifest(ds, path):
+    # what a bundle holds, enough to tell two versions apart without mapping them
+    files = {}
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.npy'):
+            values = np.load(os.path.join(path, name), mmap_mode='r')
+            files[name] = {'shape': list(values.shape), 'dtype': str(values.dtype),
+                           'bytes': os.path.getsize(os.path.join(path, name))}
+    return {'version': ds.version,
+            'build_id': BUILD_ID,
+            'built_at': ds.built_at,
+            'update': ds.update,
+            'countries': len(ds.country_index),
+            'dates': {'cases': date_range(ds.case_x_data.strftime('%Y-%m-%d')),
+                      'deaths': date_range(ds.death_x_data.strftime('%Y-%m-%d')),
+                      'vaccines': date_range(ds.vax_x_data)},
+            'totals': {field: getattr(ds, field) for field in TOTAL_FIELDS},
+            'settings': PIPELINE_SETTINGS,
+            'flags': {series: {kind: len(days) for kind, days in kinds.items()} for series, kinds in ds.flags.items()},
+            # etag, rows and fetch time of the snapshots the bundle was built from
+            'sources': read_manifest(),
+            'files': files}
+
+
+def read_bundle_manifest(path):
+    with open(os.path.join(path, BUNDLE_MANIFEST)) as f:
+        return json.load(f)
+
+
+def bundle_path(name):
+    # a bundle directory or its name in DATASET_DIR
+    return name if os.path.isdir(name) else os.path.join(DATASET_DIR, name)
+
+
+def write_pointer(name, value, directory=None):
+    pointer = os.path.join(directory or DATASET_DIR, name)
+    tmp = '%s.%d.%d.tmp' % (pointer, os.getpid(), threading.get_ident())
+    with open(tmp, 'w') as f:
+        f.write(value)
+    os.replace(tmp, pointer)
+
+
+def read_pointer(name, directory=None):
+    try:
+        with open(os.path.join(directory or DATASET_DIR, name)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def pointer_age(name, directory=None):
+    # seconds since the file was written, infinite when there is none
+    try:
+        return time.time() - os.path.getmtime(os.path.join(directory or DATASET_DIR, name))
+    except FileNotFoundError:
+        return float('inf')
+
+
+def publish_bundle(path, directory=None):
+    write_pointer(CURRENT_FILE, os.path.basename(path), directory)
+
+
+def current_bundle(directory=None):
+    # the published bundle, None without one or when it was built by other pipeline code
+    directory = directory or DATASET_DIR
+    name = read_pointer(CURRENT_FILE, directory)
+    if name is None:
+        return None
+    path = os.path.join(directory, name)
+    if not name.endswith('-' + BUILD_ID) or not os.path.isdir(path):
+        return None
+    return path
+
+
+def build_bundle(offline=None):
+    offline = is_offline() if offline is None else offline
+    sources = load_sources(offline=True) if offline else refresh_snapshots()[0]
+    version = data_version(sources)
+    path = dataset_path(version)
+    if not os.path.isdir(path):
+        ds = build_dataset(sources, version)
+        save_dataset(ds)
+        # fit the world forecast model here as well, the web processes load it from the model dir
+        get_model(ds.val, name='world_vax', wait=True)
+    publish_bundle(path)
+    return path
+
+
+def compare_bundles(old, new):
+    # what changed between two bundles: manifest fields, countries and the revised values of the common days
+    paths = [bundle_path(old), bundle_path(new)]
+    manifests = [read_bundle_manifest(path) for path in paths]
+    report = {key: [manifests[0].get(key), manifests[1].get(key)]
+              for key in ('version', 'build_id', 'built_at', 'update', 'countries', 'dates', 'totals')
+              if manifests[0].get(key) != manifests[1].get(key)}
+    old, new = [map_bundle(path) for path in paths]
+    report['countries_added'] = sorted(set(new.country_index) - set(old.country_index))
+    report['countries_removed'] = sorted(set(old.country_index) - set(new.country_index))
+    common = sorted(set(old.country_index) & set(new.country_index))
+    for cube, dates in CUBE_DATES.items():
+        old_dates, new_dates = pd.Index(getattr(old, dates)), pd.Index(getattr(new, dates))
+        days = old_dates.intersection(new_dates)
+        before = getattr(old, cube)[[old.country_index[c] for c in common]][:, old_dates.get_indexer(days)]
+        after = getattr(new, cube)[[new.country_index[c] for c in common]][:, new_dates.get_indexer(days)]
+        change = after.astype(np.int64) - before
+        revised = change != 0
+        report[cube] = {'new_days': len(new_dates.difference(old_dates)),
+                        'dropped_days': len(old_dates.difference(new_dates)),
+                        'revised_values': int(revised.sum()),
+                        'revised_countries': [common[i] for i in np.flatnonzero(revised.any(axis=1))],
+                        'largest_revision': int(np.abs(change).max()) if revised.any() else 0}
+    return report
+
+
+def bundle_command(args):
+    args = [arg for arg in args if not arg.startswith('--')]
+    if args[:1] == ['build']:
+        path = build_bundle()
+        print(json.dumps(dict(read_bundle_manifest(path), path=path), indent=2, sort_keys=True))
+    elif args[:1] == ['compare'] and len(args) == 3:
+        print(json.dumps(compare_bundles(args[1], args[2]), indent=2))
+    else:
+        print('usage: python -m vaccine_app build [--offline] | compare OLD NEW')
+        return 2
+    return 0
+
+
+### current version and background refresh
+_current = None
+_swap_lock = threading.Lock()
+# functions preparing per-version artifacts, run on a new dataset before it is swapped in
+_swap_hooks = []
+
+
+def current_dataset():
+    return _current
+
+
+def dataset_version():
+    return _current.version
+
+
+def add_swap_hook(fn):
+    _swap_hooks.append(fn)
+    if _current is not None:
+        fn(_current)
+    return fn
+
+
+def swap_dataset(ds):
+    for hook in _swap_hooks:
+        hook(ds)
+    # a single reference assignment, readers see either the old or the new version
+    global _current
+    with _swap_lock:
+        _current = ds
+    # load the forecast model from disk or start fitting it in the background
+    get_model(ds.val, name='world_vax')
+    warm_forecasts(ds)
+    prune_forecasts()
+    return ds
+
+
+def warm_forecasts(ds, countries=None):
+    # queue the per-country forecasts of the default view, the charts queue them as well when this fails
+    try:
+        for country in countries or DEFAULT_COUNTRIES:
+            for series in SERIES:
+                cumulative = metric_row(ds, series, 'Cumulative', NO_SMOOTHING, country)
+                country_forecast((country, series, ds.version), cumulative)
+    except Exception as e:
+        print('forecast warm up failed: %r' % e)
+
+
+def prune_forecasts(directory=None):
+    # forecast artifacts not used since the oldest kept dataset directory was written belong to
+    # versions that were pruned, see prune_datasets()
+    directory = directory or DATASET_DIR
+    try:
+        written = [os.path.getmtime(os.path.join(directory, name)) for name in os.listdir(directory)
+                   if not name.endswith('.tmp') and os.path.isdir(os.path.join(directory, name))]
+    except FileNotFoundError:
+        return
+    if written:
+        prune_models(min(written))
+
+
+def latest_dataset():
+    # the dataset of the last background refresh of any worker, None before one or when it was
+    # built by other pipeline code
+    version = read_pointer(LATEST_FILE)
+    return None if version is None else map_dataset(version)
+
+
+def load_dataset():
+    # the published bundle when there is one, then the dataset of the last refresh, otherwise
+    # the first worker builds the dataset. the forecast pool forks first, this process has no other thread yet
+    start_pool()
+    path = current_bundle()
+    if path is not None:
+        return swap_dataset(map_bundle(path))
+    ds = latest_dataset()
+    if ds is not None:
+        return swap_dataset(ds)
+    return swap_dataset(shared_dataset(load_sources()))
+
+
+def follow_latest():
+    ds = latest_dataset()
+    if ds is None or (_current is not None and _current.version == ds.version):
+        return _current
+    return swap_dataset(ds)
+
+
+def refresh_dataset():
+    # with a build step the web processes only follow its pointer
+    path = current_bundle()
+    if path is not None:
+        if _current is not None and dataset_path(_current.version) == path:
+            return _current
+        return swap_dataset(map_bundle(path))
+    # one worker refreshes the snapshot store and publishes the new version, the others wait
+    # for it and follow. a worker waking up just after that refresh follows it as well
+    if pointer_age(LATEST_FILE) < REFRESH_SECONDS / 2:
+        return follow_latest()
+    lock = _acquire_build_lock(os.path.join(DATASET_DIR, REFRESH_LOCK))
+    if lock is None:
+        while pointer_age(REFRESH_LOCK + '.lock') < BUILD_LOCK_TIMEOUT:
+            time.sleep(BUILD_POLL_SECONDS)
+        return follow_latest()
+    try:
+        # offline mode only re-reads the local snapshot store
+        sources = load_sources() if is_offline() else refresh_snapshots()[0]
+        version = data_version(sources)
+        ds = _current
+        if ds is None or ds.version != version:
+            ds = swap_dataset(shared_dataset(sources, version))
+        write_pointer(LATEST_FILE, version)
+        return ds
+    finally:
+        _release_build_lock(lock)
+
+
+def _refresh_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            refresh_dataset()
+        except Exception as e:
+            # keep serving the current version, try again next round
+            print('dataset refresh failed: %r' % e)
+
+
+def start_refresher(interval=None):
+    interval = REFRESH_SECONDS if interval is None else interval
+    if interval <= 0:
+        return None
+    thread = threading.Thread(target=_refresh_loop, args=(interval,), name='dataset-refresh', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,81 @@
+### concurrent, conditional download of the csv sources
+# all sources are fetched in parallel over one pooled keep-alive session. validators
+# (etag / last-modified) from the previous download are sent back so unchanged files
+# come back as 304 and are not parsed again.
+import io
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRIES = 3
+BACKOFF = 0.5
+TIMEOUT = 60
+
+# frame is None when the source was not modified
+FetchResult = namedtuple('FetchResult', ['name', 'status', 'frame', 'etag', 'last_modified', 'nbytes', 'seconds'])
+
+
+def make_session(pool_size=8, retries=RETRIES, backoff=BACKOFF):
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def conditional_headers(validators):
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def read_csv_bytes(content):
+    return pd.read_csv(io.BytesIO(content))
+
+
+def fetch_source(session, name, url, validators=None, timeout=TIMEOUT, parse=read_csv_bytes):
+    start = time.perf_counter()
+    response = session.get(url, headers=conditional_headers(validators or {}), timeout=timeout)
+    if response.status_code == 304:
+        return FetchResult(name, 304, None, (validators or {}).get('etag'), (validators or {}).get('last_modified'),
+                           0, time.perf_counter() - start)
+    response.raise_for_status()
+    frame = parse(response.content)
+    return FetchResult(name, response.status_code, frame, response.headers.get('ETag'),
+                       response.headers.get('Last-Modified'), len(response.content), time.perf_counter() - start)
+
+
+def fetch_sources(urls, validators=None, session=None, max_workers=None, parsers=None):
+    # urls: source name -> url, validators: source name -> {'etag', 'last_modified'},
+    # parsers: source name -> fn(content) -> frame, the default parses the whole csv
+    validators = validators or {}
+    parsers = parsers or {}
+    max_workers = max_workers or len(urls) or 1
+    own_session = session is None
+    session = session or make_session(pool_size=max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {name: pool.submit(fetch_source, session, name, url, validators.get(name),
+                                         parse=parsers.get(name, read_csv_bytes))
+                       for name, url in urls.items()}
+            return {name: future.result() for name, future in futures.items()}
+    finally:
+        if own_session:
+            session.close()
+
+
+def format_report(results):
+    lines = []
+    for result in results.values():
+        lines.append('%-18s %s %10d bytes %7.2fs' % (result.name, result.status, result.nbytes, result.seconds))
+    return '\n'.join(lines)
@@ -0,0 +1,190 @@
+### figure cache shared by the dash callbacks
+# callback results are stored as plotly json under a hash of the callback name, its
+# inputs, the dataset version and the app code. the default filesystem backend is shared by all
+# gunicorn workers on a dyno and evicts the least recently used files past MAX_BYTES.
+# COVID_APP_FIGURE_CACHE=memory keeps a per-process LRU instead, =off disables caching.
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import plotly
+
+CACHE_BACKEND = os.environ.get('COVID_APP_FIGURE_CACHE', 'file')
+CACHE_DIR = os.environ.get('COVID_APP_FIGURE_CACHE_DIR', os.path.join('data', 'figure_cache'))
+MAX_BYTES = int(os.environ.get('COVID_APP_FIGURE_CACHE_BYTES', 200 * 1024 * 1024))
+# the file backend checks its size every this many writes
+EVICT_EVERY = 50
+
+_stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+_lock = threading.Lock()
+
+
+### backends
+class FileCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.writes = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        # the modification time is the recency used for eviction. another worker may have
+        # evicted the file since the read, the payload is still a hit
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return payload
+
+    def set(self, key, payload):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        self.writes += 1
+        if self.writes % EVICT_EVERY == 0:
+            _count('evictions', self.evict())
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        return evicted
+
+    def size(self):
+        if not os.path.isdir(self.directory):
+            return 0, 0
+        sizes = [os.path.getsize(os.path.join(self.directory, name))
+                 for name in os.listdir(self.directory) if name.endswith('.json')]
+        return len(sizes), sum(sizes)
+
+
+class MemoryCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total = 0
+
+    def get(self, key):
+        with _lock:
+            payload = self.entries.get(key)
+            if payload is not None:
+                self.entries.move_to_end(key)
+            return payload
+
+    def set(self, key, payload):
+        with _lock:
+            if key in self.entries:
+                self.total -= len(self.entries.pop(key))
+            self.entries[key] = payload
+            self.total += len(payload)
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                self.total -= len(self.entries.popitem(last=False)[1])
+                _stats['evictions'] += 1
+
+    def size(self):
+        return len(self.entries), self.total
+
+
+def make_backend(backend=CACHE_BACKEND):
+    if backend == 'off':
+        return None
+    if backend == 'memory':
+        return MemoryCache(MAX_BYTES)
+    return FileCache(CACHE_DIR, MAX_BYTES)
+
+
+_backend = make_backend()
+
+
+### memoization
+def code_version():
+    # fingerprint of the app code and the plotly version, figures cached by an earlier deploy are not served
+    digest = hashlib.sha1(plotly.__version__.encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:8]
+
+
+CODE_VERSION = code_version()
+
+
+def cache_key(name, args, version):
+    payload = json.dumps([name, args, version, CODE_VERSION], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _count(stat, n=1):
+    with _lock:
+        _stats[stat] += n
+
+
+def cached_figure(name, version_fn):
+    # decorator for a dash callback, version_fn returns the current dataset version
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            if _backend is None:
+                return fn(*args)
+            version = version_fn()
+            key = cache_key(name, args, version)
+            payload = _backend.get(key)
+            if payload is not None:
+                _count('hits')
+                return json.loads(payload)
+            _count('misses')
+            result = fn(*args)
+            # a dataset swap during the call may have mixed versions, do not store that
+            if version_fn() == version:
+                _backend.set(key, json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder))
+                _count('writes')
+            return result
+        return wrapper
+    return decorator
+
+
+def stats():
+    with _lock:
+        report = dict(_stats)
+    lookups = report['hits'] + report['misses']
+    report['hit_rate'] = round(report['hits'] / lookups, 3) if lookups else None
+    report['backend'] = CACHE_BACKEND
+    report['code_version'] = CODE_VERSION
+    report['pid'] = os.getpid()
+    report['time'] = time.strftime("%Y-%m-%d %H:%M:%S")
+    if _backend is not None:
+        report['entries'], report['bytes'] = _backend.size()
+    return report
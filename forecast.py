@@ -0,0 +1,366 @@
+### persisted ARIMA models for the forecasts
+# a fitted model is pickled under a hash of its input series and fit parameters, so
+# workers and restarts load it instead of running auto_arima again. a missing model is
+# fitted on a background thread; until then get_model() returns None and the chart
+# shows a warming up state. a lock file keeps concurrent workers from fitting the same model.
+# when the series only grew, the latest model of that series keeps its order and is updated
+# with the new observations. the full auto_arima order search only runs again after
+# REFIT_SECONDS or when the old model's forecast of the new days drifts past DRIFT_THRESHOLD.
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pmdarima as pm
+
+MODEL_DIR = os.environ.get('COVID_APP_MODEL_DIR', os.path.join('data', 'models'))
+# full order search at least this often
+REFIT_SECONDS = int(os.environ.get('COVID_APP_ARIMA_REFIT_SECONDS', 7 * 24 * 60 * 60))
+# mean absolute forecast error on the new observations, relative to their mean level
+DRIFT_THRESHOLD = float(os.environ.get('COVID_APP_ARIMA_DRIFT', 0.05))
+# longest forecast horizon, forecasts are computed once for it and sliced per request
+MAX_HORIZON = int(os.environ.get('COVID_APP_MAX_HORIZON', 365))
+# fitted models kept in memory per process
+MAX_MODELS = 4
+# worker processes and cached results for the per-country forecasts
+FORECAST_PROCESSES = int(os.environ.get('COVID_APP_FORECAST_PROCESSES', 2))
+FORECAST_CACHE_SIZE = int(os.environ.get('COVID_APP_FORECAST_CACHE', 64))
+# the forecast chart models at most this many of the selected countries
+MAX_FORECAST_COUNTRIES = int(os.environ.get('COVID_APP_FORECAST_COUNTRIES', 8))
+# a lock file older than this is treated as left behind by a dead worker
+LOCK_TIMEOUT = 15 * 60
+
+ARIMA_PARAMS = dict(start_p=1, start_q=1,
+                    test='adf',  # use adftest to find optimal 'd'
+                    max_p=3, max_q=3,  # maximum p and q
+                    m=1,  # frequency of series
+                    d=None,  # let model determine 'd'
+                    seasonal=False,  # No Seasonality
+                    start_P=0,
+                    D=0,
+                    trace=True,
+                    error_action='ignore',
+                    suppress_warnings=True,
+                    stepwise=True)
+
+_models = {}
+_forecasts = {}
+_pending = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='arima-fit')
+
+
+def model_key(series, params=None):
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(series, dtype=float).tobytes())
+    digest.update(json.dumps(params or ARIMA_PARAMS, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def model_path(key):
+    return os.path.join(MODEL_DIR, key + '.pkl')
+
+
+def fit_model(series, params=None):
+    return pm.auto_arima(series, **(params or ARIMA_PARAMS))
+
+
+def forecast_drift(model, new_obs):
+    fc = model.predict(n_periods=len(new_obs))
+    scale = np.mean(np.abs(new_obs)) or 1.0
+    return float(np.mean(np.abs(new_obs - fc)) / scale)
+
+
+def fit_or_update(series, params=None, name='default'):
+    # returns the model and its lineage info
+    latest = read_latest(name)
+    if latest and latest['n_obs'] < len(series) and time.time() - latest['searched_at'] < REFIT_SECONDS \
+            and model_key(series[:latest['n_obs']], params) == latest['key']:
+        model = load_model(latest['key'])
+        if model is not None:
+            new_obs = series[latest['n_obs']:]
+            drift = forecast_drift(model, new_obs)
+            if drift <= DRIFT_THRESHOLD:
+                # same order, parameters refined from the current fit
+                model.update(new_obs)
+                return model, dict(latest, n_obs=len(series), updates=latest['updates'] + 1, drift=drift)
+    model = fit_model(series, params)
+    return model, {'n_obs': len(series), 'searched_at': time.time(), 'updates': 0, 'drift': 0.0,
+                   'order': list(model.order)}
+
+
+### artifacts
+def save_model(key, model):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    path = model_path(key)
+    tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(tmp, path)
+
+
+def load_model(key):
+    path = model_path(key)
+    try:
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    # the modification time marks the artifact as in use, see prune_models()
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return model
+
+
+def prune_models(before):
+    # remove the model and forecast artifacts last used before this time, the models the latest
+    # files point at are kept for the next incremental update
+    if not os.path.isdir(MODEL_DIR):
+        return 0
+    names = os.listdir(MODEL_DIR)
+    keep = set()
+    for name in names:
+        if name.startswith('latest-') and name.endswith('.json'):
+            latest = read_latest(name[len('latest-'):-len('.json')])
+            if latest:
+                keep.add(latest['key'] + '.pkl')
+    removed = 0
+    for name in names:
+        if name.endswith('.pkl') and name not in keep:
+            path = os.path.join(MODEL_DIR, name)
+            try:
+                if os.path.getmtime(path) < before:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def latest_path(name):
+    return os.path.join(MODEL_DIR, 'latest-%s.json' % name)
+
+
+def read_latest(name):
+    path = latest_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_latest(name, key, info):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    path = latest_path(name)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(dict(info, key=key), f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _acquire_fit_lock(key):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    path = model_path(key) + '.lock'
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return path
+    except FileExistsError:
+        # the holder may remove the lock between the create and these checks, then try again
+        try:
+            if time.time() - os.path.getmtime(path) <= LOCK_TIMEOUT:
+                return None
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return _acquire_fit_lock(key)
+
+
+def _release_fit_lock(path):
+    # a holder slower than LOCK_TIMEOUT may find its lock already removed as stale
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _fit_and_save(key, series, params, name):
+    try:
+        lock = _acquire_fit_lock(key)
+        if lock is None:
+            # another worker is fitting this model, get_model() picks the artifact up from disk
+            return None
+        try:
+            model, info = fit_or_update(series, params, name)
+            save_model(key, model)
+            write_latest(name, key, info)
+        finally:
+            _release_fit_lock(lock)
+        _remember(key, model)
+        return model
+    finally:
+        with _lock:
+            _pending.pop(key, None)
+
+
+### lookup
+def _remember(key, model, cache=_models):
+    with _lock:
+        cache[key] = model
+        while len(cache) > MAX_MODELS:
+            cache.pop(next(iter(cache)))
+
+
+def get_model(series, params=None, wait=False, name='default'):
+    key = model_key(series, params)
+    with _lock:
+        if key in _models:
+            return _models[key]
+    model = load_model(key)
+    if model is not None:
+        _remember(key, model)
+        return model
+    future = request_model(series, params, name)
+    return future.result() if wait else None
+
+
+def request_model(series, params=None, name='default'):
+    # start a background fit unless one is already running in this process
+    key = model_key(series, params)
+    with _lock:
+        if key not in _pending or _pending[key].done():
+            _pending[key] = _executor.submit(_fit_and_save, key, np.asarray(series, dtype=float), params,
+                                            name)
+        return _pending[key]
+
+
+def get_forecast(series, params=None, name='default'):
+    # forecast and confidence interval for MAX_HORIZON periods, None while the model is warming up
+    model = get_model(series, params, name=name)
+    if model is None:
+        return None
+    key = model_key(series, params)
+    with _lock:
+        forecast = _forecasts.get(key)
+    if forecast is None:
+        fc, confint = model.predict(n_periods=MAX_HORIZON, return_conf_int=True)
+        forecast = {'key': key, 'mean': fc, 'lower': confint[:, 0], 'upper': confint[:, 1]}
+        _remember(key, forecast, _forecasts)
+    return forecast
+
+
+def horizon(n_periods):
+    # forecast input bounded to 1..MAX_HORIZON, None when it is not a number
+    try:
+        return min(max(int(n_periods), 1), MAX_HORIZON)
+    except (TypeError, ValueError):
+        return None
+
+
+### per-country forecasts
+# fitted in a process pool so several countries are modeled in parallel outside the GIL.
+# a finished forecast is pickled under a hash of its series like the models above, so one
+# worker fits it under the fit lock and the other workers load it. results are also kept in
+# an LRU cache keyed by (country, series, data version).
+COUNTRY_PARAMS = dict(ARIMA_PARAMS, trace=False)
+
+_country_forecasts = OrderedDict()
+_country_pending = {}
+_process_pool = None
+
+
+def _pool():
+    # fork copies into the child the locks other threads hold at that moment. start_pool() forks the
+    # workers before the app starts any thread, a pool first needed later comes from a forkserver.
+    # its children import a script run as __main__ again, which for the app would fail without data
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            if threading.active_count() > 1 and 'forkserver' in methods:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            _process_pool = ProcessPoolExecutor(max_workers=FORECAST_PROCESSES, mp_context=context)
+            # a forked pool starts all its workers on the first submit
+            _process_pool.submit(os.getpid)
+        return _process_pool
+
+
+def start_pool():
+    _pool()
+
+
+def forecast_series(series, params=None, n_periods=MAX_HORIZON):
+    # runs in a pool process
+    model = fit_model(series, params or COUNTRY_PARAMS)
+    fc, confint = model.predict(n_periods=n_periods, return_conf_int=True)
+    return {'mean': fc, 'lower': confint[:, 0], 'upper': confint[:, 1], 'order': list(model.order)}
+
+
+def country_forecast_key(series):
+    return 'forecast-' + model_key(series, COUNTRY_PARAMS)
+
+
+def _remember_country_forecast(key, forecast):
+    with _lock:
+        _country_pending.pop(key, None)
+        _country_forecasts[key] = forecast
+        while len(_country_forecasts) > FORECAST_CACHE_SIZE:
+            _country_forecasts.popitem(last=False)
+
+
+def _store_country_forecast(key, artifact, lock, future):
+    try:
+        try:
+            forecast = future.result()
+            save_model(artifact, forecast)
+        except Exception as e:
+            # remember the failure in this process so the series is not refitted on every poll,
+            # a later version or restart tries again
+            print('forecast %r failed: %r' % (key, e))
+            forecast = {'error': repr(e)}
+    finally:
+        _release_fit_lock(lock)
+    _remember_country_forecast(key, forecast)
+
+
+def country_forecast(key, series):
+    # key is (country, series name, data version). returns the forecast, or None while it is
+    # being fitted here or in another worker
+    with _lock:
+        if key in _country_forecasts:
+            _country_forecasts.move_to_end(key)
+            return _country_forecasts[key]
+        if key in _country_pending:
+            return None
+    artifact = country_forecast_key(series)
+    forecast = load_model(artifact)
+    if forecast is None:
+        lock = _acquire_fit_lock(artifact)
+        if lock is None:
+            # another worker is fitting it, a later poll loads the artifact
+            return None
+        # it may have been saved between the load and the lock
+        forecast = load_model(artifact)
+        if forecast is None:
+            try:
+                future = _pool().submit(forecast_series, np.asarray(series, dtype=float))
+            except Exception:
+                _release_fit_lock(lock)
+                raise
+            with _lock:
+                _country_pending[key] = future
+            future.add_done_callback(lambda f: _store_country_forecast(key, artifact, lock, f))
+            return None
+        _release_fit_lock(lock)
+    _remember_country_forecast(key, forecast)
+    return forecast
@@ -0,0 +1,253 @@
+### metric engine for the country grid
+# every (series, metric) combination is computed for all countries in one batched pass when
+# a dataset is built, a smoothing is added for all countries the first time it is asked for.
+# callbacks only index into the table.
+# a new metric is added with register_metric(), a new smoothing level in SMOOTHING.
+# run `python metrics.py` to time the daily change stage against the old per-country transform.
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+### daily values
+def daily_values(cumulative):
+    # difference to the previous day along the last axis, the first day is 0
+    new = np.empty_like(cumulative)
+    if cumulative.shape[-1]:
+        new[..., 0] = 0
+        np.subtract(cumulative[..., 1:], cumulative[..., :-1], out=new[..., 1:])
+    return new
+
+
+def abs_daily_values(cumulative):
+    # absolute change between reports, the first report counts in full like s.sub(s.shift().fillna(0)).abs()
+    new = np.abs(daily_values(cumulative))
+    if cumulative.shape[-1]:
+        new[..., 0] = np.abs(cumulative[..., 0])
+    return new
+
+
+def clipped_daily_values(cumulative):
+    # a drop of the total is a day without change
+    return np.maximum(daily_values(cumulative), 0)
+
+
+def spread_daily_values(cumulative):
+    # a drop of the total is taken back from the days before it: every day is capped by the later totals
+    capped = np.fmin.accumulate(cumulative[..., ::-1], axis=-1)[..., ::-1]
+    return daily_values(capped)
+
+
+def revisions(cumulative):
+    # (row, day) of every day on which a [country, date] total went down
+    return np.argwhere(cumulative[:, 1:] < cumulative[:, :-1]) + [0, 1]
+
+
+# how a downward revision of a cumulative total shows in the daily values, all series follow
+# COVID_APP_REVISION_POLICY when it is set
+REVISION_POLICIES = {
+    'abs': abs_daily_values,
+    'clip': clipped_daily_values,
+    'spread': spread_daily_values,
+    # kept as a negative day, the days are listed in Dataset.flags[series]['negative'] and counted by
+    # quality.quality_issues
+    'flag': daily_values,
+}
+REVISION_POLICY = os.environ.get('COVID_APP_REVISION_POLICY', '')
+if REVISION_POLICY and REVISION_POLICY not in REVISION_POLICIES:
+    raise ValueError('COVID_APP_REVISION_POLICY=%s is not one of: %s'
+                     % (REVISION_POLICY, ', '.join(sorted(REVISION_POLICIES))))
+
+
+### smoothing
+# one engine for every chart: the output has the length of the input and each value stays on
+# its own date. windows are prefix sum differences, batched over the rows of a [country, date] array
+def window_sums(values, window):
+    # sum of the window ending on each day, nan until a full window is available and
+    # for every window that contains a nan day
+    values = np.asarray(values, dtype=float)
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] >= window:
+        missing = np.isnan(values)
+        total = np.cumsum(np.where(missing, 0, values), axis=-1)
+        gaps = np.cumsum(missing, axis=-1)
+        out[..., window - 1] = total[..., window - 1]
+        out[..., window:] = total[..., window:] - total[..., :-window]
+        gaps[..., window:] -= gaps[..., :-window].copy()
+        out[..., window - 1:][gaps[..., window - 1:] > 0] = np.nan
+    return out
+
+
+def trailing_mean(values, window):
+    return window_sums(values, window) / window
+
+
+def centered_mean(values, window):
+    # mean of the window around each day, like rolling(window, center=True).mean()
+    trailing = trailing_mean(values, window)
+    shift = (window - 1) // 2
+    out = np.full(trailing.shape, np.nan)
+    out[..., :trailing.shape[-1] - shift] = trailing[..., shift:]
+    return out
+
+
+def ewma(values, window):
+    # exponentially weighted mean with span window, nan days keep the previous value
+    values = np.asarray(values, dtype=float)
+    rows = values.reshape(-1, values.shape[-1])
+    out = pd.DataFrame(rows.T).ewm(span=window, adjust=False, ignore_na=True).mean().to_numpy().T
+    return out.reshape(values.shape)
+
+
+SMOOTHERS = {
+    'trailing': trailing_mean,
+    'centered': centered_mean,
+    'ewma': ewma,
+}
+
+NO_SMOOTHING = 'No Smoothing'
+# dropdown label -> (window, smoother)
+SMOOTHING = {
+    NO_SMOOTHING: (1, 'trailing'),
+    '7 Day Moving Average': (7, 'trailing'),
+    '30 Day Moving Average': (30, 'trailing'),
+    '7 Day Centered Average': (7, 'centered'),
+    '7 Day Exponential Average': (7, 'ewma'),
+}
+
+
+def smooth(values, smoothing):
+    window, method = SMOOTHING[smoothing]
+    return values if window == 1 else SMOOTHERS[method](values, window)
+
+
+# series -> daily transform, without a policy the vaccine series keep the absolute change of the
+# GovEx Doses_daily column and the JHU series their signed change
+SERIES = {
+    'doses': abs_daily_values,
+    'fullvax': abs_daily_values,
+    'cases': daily_values,
+    'deaths': daily_values,
+}
+if REVISION_POLICY:
+    SERIES = {series: REVISION_POLICIES[REVISION_POLICY] for series in SERIES}
+
+
+### metrics
+# metric name -> function(cumulative, daily, population) returning a [country, date] array
+METRICS = {}
+
+
+def register_metric(name, fn):
+    METRICS[name] = fn
+    return fn
+
+
+def per_capita(values, population):
+    return values / population[:, None] * 100
+
+
+register_metric('Cumulative', lambda cumulative, daily, population: cumulative)
+register_metric('Daily', lambda cumulative, daily, population: daily)
+register_metric('Cumulative Per Capita', lambda cumulative, daily, population: per_capita(cumulative, population))
+register_metric('Daily Per Capita', lambda cumulative, daily, population: per_capita(daily, population))
+
+
+### table
+def build_metric_table(cubes, population):
+    # cubes: series name -> cumulative [country, date] array, rows aligned with population
+    table = {}
+    for series, cumulative in cubes.items():
+        daily = SERIES[series](cumulative)
+        for metric, metric_fn in METRICS.items():
+            table[(series, metric, NO_SMOOTHING)] = metric_fn(cumulative, daily, population)
+    return table
+
+
+def metric_values(ds, series, metric, smoothing):
+    # [country, date] array of one table entry, smoothed variants are kept once computed
+    key = (series, metric, smoothing)
+    values = ds.metric_table.get(key)
+    if values is None:
+        values = smooth(ds.metric_table[(series, metric, NO_SMOOTHING)], smoothing)
+        ds.metric_table[key] = values
+    return values
+
+
+def country_rows(ds, countries):
+    # table row of each country, None for names that are not in the dataset
+    return [ds.country_index.get(country) for country in countries]
+
+
+def metric_rows(ds, series, metric, smoothing, rows):
+    # one gather for all selected countries, unknown countries get a row of zeros
+    values = metric_values(ds, series, metric, smoothing)
+    index = np.array([-1 if i is None else i for i in rows], dtype=int)
+    selected = values[np.maximum(index, 0)]
+    selected[index < 0] = 0
+    return selected
+
+
+def metric_row(ds, series, metric, smoothing, country):
+    return metric_rows(ds, series, metric, smoothing, country_rows(ds, [country]))[0]
+
+
+### world aggregates
+# the country series plus the world share of people fully vaccinated
+WORLD_SERIES = dict(SERIES, percentvax=SERIES['fullvax'])
+# the world charts plot the per capita metrics as plain counts
+WORLD_METRICS = {
+    'Cumulative': 'Cumulative',
+    'Daily': 'Daily',
+    'Cumulative Per Capita': 'Cumulative',
+    'Daily Per Capita': 'Daily',
+}
+
+
+def build_world_table(world):
+    # world: series name -> cumulative 1d array over the dates of that series
+    table = {}
+    for series, cumulative in world.items():
+        for metric, values in (('Cumulative', cumulative), ('Daily', WORLD_SERIES[series](cumulative))):
+            for smoothing in SMOOTHING:
+                table[(series, metric, smoothing)] = smooth(values, smoothing)
+    return table
+
+
+def world_values(ds, series, metric='Cumulative', smoothing='No Smoothing'):
+    return ds.world_table[(series, WORLD_METRICS[metric], smoothing)]
+
+
+### daily change benchmark
+def benchmark(sizes=((50, 250), (100, 500), (200, 1000), (300, 1500))):
+    # the old per-country lambda over a long GovEx frame against one batched diff of the cube,
+    # the pivot to the cube is listed apart since the charts need it either way
+    from dataset import long_cube
+    rng = np.random.default_rng(0)
+    print('%9s %6s %8s %12s %10s %12s' % ('countries', 'days', 'rows', 'lambda (ms)', 'pivot (ms)', 'batched (ms)'))
+    for n_countries, n_days in sizes:
+        dates = pd.date_range('2020-12-14', periods=n_days).strftime('%Y-%m-%d')
+        frame = pd.DataFrame({
+            'country': pd.Categorical(np.repeat(['country %d' % i for i in range(n_countries)], n_days)),
+            'Date': np.tile(dates, n_countries),
+            'Doses_admin': rng.poisson(1000, (n_countries, n_days)).cumsum(axis=1).ravel()})
+        timings = []
+        start = time.perf_counter()
+        frame.groupby(['country'], observed=True)['Doses_admin'].transform(
+            lambda s: s.sub(s.shift().fillna(0)).abs())
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        cube = long_cube(frame, 'Doses_admin', list(frame['country'].cat.categories), list(dates))
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        SERIES['doses'](cube)
+        revisions(cube)
+        timings.append(time.perf_counter() - start)
+        print('%9d %6d %8d %12.1f %10.1f %12.1f' % ((n_countries, n_days, len(frame)) +
+                                                    tuple(seconds * 1000 for seconds in timings)))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,223 @@
+### optional compact encoding of the time series figures
+# with COVID_APP_COMPACT_PAYLOAD=1 every date axis trace is reduced before it is sent:
+# series longer than MAX_POINTS are downsampled with largest-triangle-three-buckets, values
+# are rounded to SIGNIFICANT_DIGITS and evenly spaced daily dates become x0/dx instead of
+# one string per day. traces that are sent on x0/dx already keep an even spacing when they
+# are downsampled. run `python payload.py` for the response sizes with and without it.
+import functools
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+COMPACT = os.environ.get('COVID_APP_COMPACT_PAYLOAD', '') not in ('', '0')
+# roughly the width of a chart in pixels
+MAX_POINTS = int(os.environ.get('COVID_APP_MAX_POINTS', 800))
+SIGNIFICANT_DIGITS = int(os.environ.get('COVID_APP_PAYLOAD_DIGITS', 5))
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def payload_mode():
+    # part of the figure cache version, compact and full figures are cached apart
+    return '-compact' if COMPACT else ''
+
+
+### reduction
+def lttb(x, y, n_out):
+    # indices of the points kept by largest-triangle-three-buckets, the first and last point are always kept
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # mean point of every bucket, the final point stands in for the bucket after the last one
+    counts = np.diff(edges)
+    mean_x = np.append(np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts, x[n - 1])
+    mean_y = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts, y[n - 1])
+    # buckets hold a handful of points, plain floats are faster than numpy slices here
+    x, y, edges = x.tolist(), y.tolist(), edges.tolist()
+    keep = [0]
+    a = 0
+    for i in range(n_out - 2):
+        ax, ay, cx, cy = x[a], y[a], mean_x[i + 1], mean_y[i + 1]
+        best = -1.0
+        for j in range(edges[i], edges[i + 1]):
+            area = abs((ax - cx) * (y[j] - ay) - (ax - x[j]) * (cy - ay))
+            if area > best:
+                best, a = area, j
+        keep.append(a)
+    keep.append(n - 1)
+    return np.array(keep)
+
+
+def round_significant(values, digits=SIGNIFICANT_DIGITS):
+    out = np.array(values, dtype=float)
+    nonzero = np.isfinite(out) & (out != 0)
+    exponent = digits - 1 - np.floor(np.log10(np.abs(out[nonzero]))).astype(int)
+    # scale by exact powers of ten so the rounded floats print short
+    scale = 10.0 ** np.abs(exponent)
+    rounded = out[nonzero]
+    up = exponent >= 0
+    rounded[up] = np.round(rounded[up] * scale[up]) / scale[up]
+    rounded[~up] = np.round(rounded[~up] / scale[~up]) * scale[~up]
+    out[nonzero] = rounded
+    # whole numbers are sent without the trailing .0
+    if np.isfinite(out).all() and (out == np.round(out)).all():
+        return out.astype(np.int64)
+    return out
+
+
+def date_axis(x):
+    # the x values as a DatetimeIndex, None when they are not dates
+    x = np.asarray(x)
+    if x.dtype.kind not in 'OUSM':
+        return None
+    try:
+        return pd.DatetimeIndex(pd.to_datetime(x))
+    except (ValueError, TypeError):
+        return None
+
+
+def daily_axis(dates):
+    # x0 / dx for dates one day apart, None when the spacing is irregular
+    step = np.diff(dates.asi8)
+    if len(step) and (step == DAY_MS * 1000000).all():
+        return {'x0': dates[0].strftime('%Y-%m-%d'), 'dx': DAY_MS}
+    return None
+
+
+def compact_trace(trace, max_points=MAX_POINTS, parsed=None):
+    # parsed: id of an x array -> its dates, traces of one figure usually share the axis
+    if hasattr(trace, 'to_plotly_json'):
+        trace = trace.to_plotly_json()
+    x, y = trace.get('x'), trace.get('y')
+    if x is None and 'x0' in trace and 'dx' in trace:
+        return compact_spaced_trace(trace, max_points)
+    if x is None or y is None or len(x) != len(y) or len(x) == 0:
+        return trace
+    parsed = {} if parsed is None else parsed
+    if id(x) not in parsed:
+        parsed[id(x)] = date_axis(x)
+    dates = parsed[id(x)]
+    if dates is None:
+        return trace
+    y = np.asarray(y, dtype=float)
+    trace = dict(trace)
+    if len(y) > max_points:
+        # leading nan days of the moving averages are not drawn anyway
+        finite = np.flatnonzero(np.isfinite(y))
+        days = dates.asi8[finite] / (DAY_MS * 1e6)
+        keep = finite[lttb(days, y[finite], max_points)]
+        trace['x'] = np.datetime_as_string(dates.values[keep], unit='D')
+        trace['y'] = round_significant(y[keep])
+    else:
+        axis = daily_axis(dates)
+        if axis is not None:
+            trace.pop('x')
+            trace.update(axis)
+        else:
+            trace['x'] = np.datetime_as_string(dates.values, unit='D')
+        trace['y'] = round_significant(y)
+    return trace
+
+
+def compact_spaced_trace(trace, max_points=MAX_POINTS):
+    # a trace already on an x0 / dx axis keeps one. lttb would pick uneven days, every step-th
+    # value counted back from the last day is kept instead and dx grows by the step
+    y = trace.get('y')
+    if y is None or len(y) == 0:
+        return trace
+    y = np.asarray(y, dtype=float)
+    trace = dict(trace)
+    step = -(-len(y) // max_points)
+    if step > 1:
+        offset = (len(y) - 1) % step
+        y = y[offset::step]
+        x0 = trace['x0']
+        if isinstance(x0, str):
+            trace['x0'] = (pd.Timestamp(x0) + pd.Timedelta(milliseconds=offset * trace['dx'])).strftime('%Y-%m-%d')
+        else:
+            trace['x0'] = x0 + offset * trace['dx']
+        trace['dx'] = trace['dx'] * step
+    trace['y'] = round_significant(y)
+    return trace
+
+
+def compact_figure(figure):
+    if hasattr(figure, 'to_plotly_json'):
+        figure = figure.to_plotly_json()
+    if not isinstance(figure, dict) or 'data' not in figure:
+        return figure
+    layout = figure.get('layout')
+    if hasattr(layout, 'to_plotly_json'):
+        layout = layout.to_plotly_json()
+    parsed = {}
+    return dict(figure, data=[compact_trace(trace, parsed=parsed) for trace in figure['data']], layout=layout)
+
+
+def compact_figures(fn):
+    # decorator for a callback returning a figure or a list / tuple of outputs
+    @functools.wraps(fn)
+    def wrapper(*args):
+        result = fn(*args)
+        if not COMPACT:
+            return result
+        if isinstance(result, (list, tuple)):
+            return type(result)(compact_figure(output) for output in result)
+        return compact_figure(result)
+    return wrapper
+
+
+### response size benchmark
+BENCHMARK_CALLBACKS = [
+    ('country grid, 4 countries', ['dose', 'fullvax', 'case', 'death'],
+     {'countryselect': ['US', 'China', 'Brazil', 'India'], 'metricselect': 'Cumulative',
+      'smoothselect': 'No Smoothing'}),
+    ('country grid, 20 countries', ['dose', 'fullvax', 'case', 'death'],
+     {'countryselect': None, 'metricselect': 'Daily', 'smoothselect': '7 Day Moving Average'}),
+    ('world vaccine', ['world_vax'], {'metricselect': 'Cumulative', 'smoothselect': 'No Smoothing'}),
+    ('world covid', ['world_covid'], {'metricselect': 'Daily', 'smoothselect': '7 Day Moving Average'}),
+    ('world area', ['world_area'], {'dataselect': 'confirmed'}),
+    ('world daily', ['world_daily'], {'dataselect': 'Doses_admin'}),
+]
+
+
+def response_bytes(client, outputs, inputs):
+    if len(outputs) == 1:
+        output = outputs[0] + '.figure'
+        output_spec = {'id': outputs[0], 'property': 'figure'}
+    else:
+        output = '..' + '...'.join(graph + '.figure' for graph in outputs) + '..'
+        output_spec = [{'id': graph, 'property': 'figure'} for graph in outputs]
+    body = {'output': output, 'outputs': output_spec,
+            'inputs': [{'id': name, 'property': 'value', 'value': value} for name, value in inputs.items()],
+            'changedPropIds': [next(iter(inputs)) + '.value']}
+    response = client.post('/_dash-update-component', json=body)
+    if response.status_code != 200:
+        raise RuntimeError('%s: %s' % (output, response.status_code))
+    return len(response.data)
+
+
+def benchmark():
+    global COMPACT
+    import figure_cache
+    import vaccine_app
+    # measure the callbacks themselves
+    figure_cache._backend = None
+    ds = vaccine_app.current_dataset()
+    client = vaccine_app.server.test_client()
+    print('%-28s %12s %12s %7s' % ('callback', 'full bytes', 'compact', 'ratio'))
+    for label, outputs, inputs in BENCHMARK_CALLBACKS:
+        if 'countryselect' in inputs and inputs['countryselect'] is None:
+            inputs = dict(inputs, countryselect=list(ds.country_list['country'][:20]))
+        sizes = []
+        for compact in (False, True):
+            COMPACT = compact
+            sizes.append(response_bytes(client, outputs, inputs))
+        print('%-28s %12d %12d %7.2f' % (label, sizes[0], sizes[1], sizes[1] / sizes[0]))
+
+
+if __name__ == '__main__':
+    # the app imports this module under its own name, switch the mode there
+    sys.modules['payload'] = sys.modules['__main__']
+    benchmark()
@@ -0,0 +1,115 @@
+### data quality checks over the country series
+# run once per dataset version when it is built, over the whole [country, date] cube of each
+# series at once: negative daily changes (downward revisions), single-day spikes far above the
+# days before them (backfills and dumps) and stale series that stopped changing. the result is
+# a per-country report and the flagged days, which the country grid can mark. with
+# COVID_APP_REPAIR=1 the charts are drawn from repaired cubes, the checks always see the data as reported.
+import os
+
+import numpy as np
+import pandas as pd
+
+from metrics import daily_values, revisions, trailing_mean
+
+# days before a daily value whose mean is its baseline
+BASELINE_DAYS = 28
+# an outlier is above this multiple of its baseline and above MIN_OUTLIER, small counts jump around
+OUTLIER_FACTOR = 10
+MIN_OUTLIER = 100
+# a series without any change over this many final days is stale
+STALE_DAYS = 14
+# longest run of low reports that repair() treats as a dip rather than a revision
+DIP_DAYS = 7
+REPAIR = os.environ.get('COVID_APP_REPAIR', '') not in ('', '0')
+FLAG_KINDS = ['negative', 'outlier']
+
+
+### checks
+def baselines(cumulative):
+    # mean of the BASELINE_DAYS daily values before each day, nan until there are enough days
+    daily = np.maximum(daily_values(cumulative.astype(float)), 0)
+    out = np.full(daily.shape, np.nan)
+    out[:, 1:] = trailing_mean(daily, BASELINE_DAYS)[:, :-1]
+    return out
+
+
+def outliers(cumulative):
+    # (row, day) of the daily values far above their baseline. a series starting from zero is not an outlier
+    daily = daily_values(cumulative.astype(float))
+    baseline = baselines(cumulative)
+    with np.errstate(invalid='ignore'):
+        spike = (baseline > 0) & (daily > OUTLIER_FACTOR * baseline) & (daily > MIN_OUTLIER)
+    return np.argwhere(spike)
+
+
+def stale_days(cumulative):
+    # days since each row last changed, the full length for rows that never did
+    changed = cumulative[:, 1:] != cumulative[:, :-1]
+    n = changed.shape[1]
+    last = n - 1 - np.argmax(changed[:, ::-1], axis=1)
+    return np.where(changed.any(axis=1), n - 1 - last, n + 1)
+
+
+def check_series(cubes):
+    # series -> flag kind -> (country row, day) pairs
+    return {series: {'negative': revisions(cube), 'outlier': outliers(cube)} for series, cube in cubes.items()}
+
+
+### report
+def quality_report(flags, cubes, countries):
+    # one row per country: flagged days of each series and days since it last changed,
+    # series that are all zero count as never stale
+    columns = {}
+    for series, cube in cubes.items():
+        for kind in FLAG_KINDS:
+            columns['%s_%s' % (series, kind)] = np.bincount(flags[series][kind][:, 0], minlength=len(countries))
+        columns['%s_stale_days' % series] = np.where(cube[:, -1] != 0, stale_days(cube), 0)
+    return pd.DataFrame(columns, index=pd.Index(countries, name='country'))
+
+
+def quality_issues(report):
+    # country -> its flag counts and stale series, for the countries with any
+    flagged = report.filter(regex='_(%s)$' % '|'.join(FLAG_KINDS))
+    stale = report.filter(like='_stale_days')
+    issues = {}
+    for country in report.index[(flagged > 0).any(axis=1) | (stale >= STALE_DAYS).any(axis=1)]:
+        row = {column: int(value) for column, value in flagged.loc[country].items() if value > 0}
+        row.update({column: int(value) for column, value in stale.loc[country].items() if value >= STALE_DAYS})
+        issues[country] = row
+    return issues
+
+
+def selected_flags(flags, rows):
+    # (position in rows, day, kind) of the flagged days of the selected rows
+    position = {row: i for i, row in enumerate(rows) if row is not None}
+    points = []
+    for kind in FLAG_KINDS:
+        days = flags[kind]
+        for row, day in days[np.isin(days[:, 0], list(position))]:
+            points.append((position[row], int(day), kind))
+    return sorted(points)
+
+
+### repair
+def repair(cumulative, flags):
+    # copy of a cube with the flagged days repaired, the totals after a flagged day are kept.
+    # a run of at most DIP_DAYS days below an earlier total that then recovers takes that total,
+    # the excess of an outlier is spread evenly over its baseline days and any drop left is
+    # taken back from the days before it
+    values = cumulative.astype(np.int64)
+    high = np.maximum.accumulate(values, axis=1)
+    recovers = np.zeros(values.shape, dtype=bool)
+    for k in range(1, DIP_DAYS + 1):
+        recovers[:, :-k] |= values[:, k:] >= high[:, :-k]
+    values = np.where((values < high) & recovers, high, values)
+    if len(flags['outlier']):
+        # the rebound after a dip is no longer an outlier once the dip is gone
+        baseline = baselines(values)
+        daily = daily_values(values)
+        ramp = np.arange(1, BASELINE_DAYS + 1) / BASELINE_DAYS
+        for row, day in flags['outlier']:
+            excess = daily[row, day] - baseline[row, day]
+            if excess > 0:
+                values[row, day - BASELINE_DAYS:day] += np.round(excess * ramp).astype(np.int64)
+    values = np.fmin.accumulate(values[:, ::-1], axis=1)[:, ::-1]
+    return values.astype(cumulative.dtype)
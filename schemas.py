@@ -0,0 +1,130 @@
+### explicit schemas of the csv sources
+# every source is read with only the columns the dataset uses and fixed dtypes instead of
+# inferring them over 1000+ columns. long files are parsed in chunks of CHUNK_ROWS rows and
+# repeated names become categoricals, so no frame of object columns is built on the way.
+# run `python schemas.py` for the peak memory of parsing with and without the schemas.
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+from collections import defaultdict, namedtuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+CHUNK_ROWS = int(os.environ.get('COVID_APP_CSV_CHUNK_ROWS', 50000))
+
+# columns: the columns read, None for all. dtypes: column -> dtype. other: dtype of the
+# remaining (date) columns of a wide file
+Schema = namedtuple('Schema', ['columns', 'dtypes', 'other'])
+
+# columns kept from the GovEx time series, the country and world frames
+GOVEX_COLUMNS = ['Country_Region', 'Province_State', 'Date', 'Doses_admin', 'People_fully_vaccinated']
+# JHU wide files keep every column, the append-only snapshot compares them with the file header.
+# counts fit int32, US cases are still far below 2**31
+JHU_WIDE = Schema(None, {'Province/State': 'category', 'Country/Region': 'category', 'Lat': np.float64,
+                         'Long': np.float64}, np.int32)
+
+SCHEMAS = {
+    'deaths': JHU_WIDE,
+    'confirmed': JHU_WIDE,
+    'country': Schema(['Country_Region', 'Last_Update', 'Lat', 'Long_', 'Confirmed', 'Deaths', 'Recovered', 'Active'],
+                      {'Country_Region': object, 'Last_Update': object, 'Lat': np.float64, 'Long_': np.float64,
+                       'Confirmed': np.int64, 'Deaths': np.int64, 'Recovered': np.float64, 'Active': np.float64},
+                      None),
+    'country_vax': Schema(['Country_Region', 'Province_State', 'Doses_admin', 'People_partially_vaccinated',
+                           'People_fully_vaccinated'],
+                          {'Country_Region': object, 'Province_State': object, 'Doses_admin': np.int64,
+                           'People_partially_vaccinated': np.int64, 'People_fully_vaccinated': np.int64}, None),
+    'global_vax_full': Schema(GOVEX_COLUMNS,
+                              {'Country_Region': 'category', 'Province_State': 'category', 'Date': 'category',
+                               'Doses_admin': np.int64, 'People_fully_vaccinated': np.int64}, None),
+    'population': Schema(['Country(or dependency)', 'Population(2020)'],
+                         {'Country(or dependency)': object, 'Population(2020)': np.int64}, None),
+}
+
+
+### parsing
+def read_chunks(source, columns, dtypes, other, chunksize):
+    dtype = defaultdict(lambda: other, dtypes) if other is not None else dtypes
+    return list(pd.read_csv(source, usecols=columns, dtype=dtype, chunksize=chunksize))
+
+
+def concat_chunks(chunks):
+    # one frame from the chunks, categoricals are unioned instead of falling back to object
+    if len(chunks) == 1:
+        return chunks[0]
+    columns = {}
+    for column in chunks[0].columns:
+        parts = [chunk.pop(column) for chunk in chunks]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals(parts)
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def read_source(name, source, chunksize=CHUNK_ROWS):
+    # source: a path or the downloaded bytes, names without a schema are parsed with the pandas defaults
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    schema = SCHEMAS.get(name)
+    if schema is None:
+        return pd.read_csv(source)
+    try:
+        chunks = read_chunks(source, schema.columns, schema.dtypes, schema.other, chunksize)
+    except ValueError:
+        # a blank count cannot be an integer, read the integer columns as floats like the defaults would
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        dtypes = {column: np.float64 if dtype in (np.int32, np.int64) else dtype
+                  for column, dtype in schema.dtypes.items()}
+        other = np.float64 if schema.other in (np.int32, np.int64) else schema.other
+        chunks = read_chunks(source, schema.columns, dtypes, other, chunksize)
+    return concat_chunks(chunks)
+
+
+def read_columns(name, source):
+    # the date columns of a wide file on their own, see data_store.ingest_wide
+    try:
+        return pd.read_csv(source, dtype=SCHEMAS[name].other)
+    except ValueError:
+        source.seek(0)
+        return pd.read_csv(source, dtype=np.float64)
+
+
+### peak memory benchmark
+def parse_all(mode, fixture_dir):
+    from data_store import SOURCES, source_filename
+    paths = {name: os.path.join(fixture_dir, source_filename(name)) for name in SOURCES}
+    paths['population'] = os.path.join('data', 'population_by_country_2020.csv')
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if mode == 'schema':
+        frames = {name: read_source(name, path) for name, path in paths.items()}
+    else:
+        frames = {name: pd.read_csv(path) for name, path in paths.items()}
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux
+    return {'peak_mb': round((peak - before) / 1024, 1),
+            'frames_mb': round(sum(frame.memory_usage(deep=True).sum() for frame in frames.values()) / 2 ** 20, 1)}
+
+
+def benchmark(fixture_dir):
+    print('%-8s %14s %12s' % ('loader', 'peak rss (MB)', 'frames (MB)'))
+    for mode in ('default', 'schema'):
+        # a fresh process each, ru_maxrss never goes down
+        output = subprocess.run([sys.executable, __file__, '--parse', mode, fixture_dir], check=True,
+                                capture_output=True, text=True).stdout
+        report = json.loads(output)
+        print('%-8s %14.1f %12.1f' % (mode, report['peak_mb'], report['frames_mb']))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--parse']:
+        print(json.dumps(parse_all(sys.argv[2], sys.argv[3])))
+    else:
+        from data_store import FIXTURE_DIR
+        benchmark(sys.argv[1] if len(sys.argv) > 1 else FIXTURE_DIR)
@@ -0,0 +1,95 @@
+### snapshot store: append-only ingestion of the JHU wide files (data_store.ingest_wide) and the manifest
+import threading
+
+import pandas as pd
+import pytest
+
+from data_store import ingest_wide, parse_source, read_manifest, read_snapshot, update_manifest, write_snapshot
+from schemas import read_source
+
+HEADER = 'Province/State,Country/Region,Lat,Long'
+ROWS = [
+    (',Afghanistan,33.93911,67.709953', [0, 1, 4, 4, 7]),
+    ('Australian Capital Territory,Australia,-35.4735,149.0124', [2, 2, 3, 5, 5]),
+    # quoted names hold commas, only the date columns on the right are split off
+    ('"Bonaire, Sint Eustatius and Saba",Netherlands,12.1784,-68.2385', [0, 0, 0, 1, 1]),
+    (',"Korea, South",35.907757,127.766922', [10, 11, 13, 13, 20]),
+]
+DATES = ['1/22/20', '1/23/20', '1/24/20', '1/25/20', '1/26/20']
+
+
+def wide_csv(n_dates, rows=ROWS):
+    lines = [','.join([HEADER] + DATES[:n_dates])]
+    lines += [','.join([fields] + [str(value) for value in values[:n_dates]]) for fields, values in rows]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def stored(n_dates, rows=ROWS):
+    return ingest_wide('confirmed', wide_csv(n_dates, rows))
+
+
+def test_append_equals_full_parse():
+    old, info = stored(3)
+    assert info['ingest'] == 'full'
+    frame, info = ingest_wide('confirmed', wide_csv(5), old, info['checksum'])
+    assert info['ingest'] == 'append'
+    assert info['parsed_columns'] == 2
+    pd.testing.assert_frame_equal(frame, read_source('confirmed', wide_csv(5)))
+    assert info['checksum'] == ingest_wide('confirmed', wide_csv(5))[1]['checksum']
+
+
+def test_unchanged_file_parses_nothing():
+    old, info = stored(5)
+    frame, info = ingest_wide('confirmed', wide_csv(5), old, info['checksum'])
+    assert (info['ingest'], info['parsed_columns']) == ('append', 0)
+    pd.testing.assert_frame_equal(frame, old)
+
+
+@pytest.mark.parametrize('rows', [
+    # a revised value of a stored date
+    [ROWS[0], (ROWS[1][0], [2, 2, 2, 5, 5])] + ROWS[2:],
+    # a revised location field
+    [(',Afghanistan,33.9,67.709953', ROWS[0][1])] + ROWS[1:],
+    # a new row
+    ROWS + [(',Albania,41.1533,20.1683', [0, 0, 1, 2, 3])],
+    # reordered rows
+    ROWS[::-1],
+], ids=['revised value', 'revised location', 'new row', 'reordered rows'])
+def test_revised_history_parses_the_whole_file(rows):
+    old, info = stored(3)
+    frame, info = ingest_wide('confirmed', wide_csv(5, rows), old, info['checksum'])
+    assert info['ingest'] == 'full'
+    pd.testing.assert_frame_equal(frame, read_source('confirmed', wide_csv(5, rows)))
+
+
+def test_without_checksum_parses_the_whole_file():
+    old, _ = stored(3)
+    frame, info = ingest_wide('confirmed', wide_csv(5), old, None)
+    assert info['ingest'] == 'full'
+    pd.testing.assert_frame_equal(frame, read_source('confirmed', wide_csv(5)))
+
+
+def test_append_to_stored_snapshot(tmp_path):
+    # the stored frame comes back from parquet, the checksum from the manifest
+    old, info = stored(3)
+    write_snapshot('confirmed', old, str(tmp_path), **info)
+    frame, info = parse_source('confirmed', wide_csv(5), str(tmp_path))
+    assert info['ingest'] == 'append'
+    write_snapshot('confirmed', frame, str(tmp_path), **info)
+    pd.testing.assert_frame_equal(read_snapshot('confirmed', str(tmp_path)), read_source('confirmed', wide_csv(5)))
+
+
+def test_concurrent_manifest_updates_are_not_lost(tmp_path):
+    def update(thread):
+        for i in range(25):
+            update_manifest('source %d' % thread, {'update %d' % i: i}, str(tmp_path))
+
+    threads = [threading.Thread(target=update, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    manifest = read_manifest(str(tmp_path))
+    assert sorted(manifest) == ['source %d' % thread for thread in range(4)]
+    assert all(len(entry) == 25 for entry in manifest.values())
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['manifest.json']
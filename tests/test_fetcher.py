@@ -0,0 +1,101 @@
+### conditional, retried downloads against a local stand-in server
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from fetcher import fetch_source, fetch_sources, make_session
+
+CSV = b'country,value\nUS,1\nIndia,2\n'
+ETAG = '"v1"'
+LAST_MODIFIED = 'Mon, 01 Mar 2021 00:00:00 GMT'
+
+
+class Handler(BaseHTTPRequestHandler):
+    # path -> number of requests, /flaky.csv fails twice before it answers
+    requests = {}
+
+    def do_GET(self):
+        count = self.requests[self.path] = self.requests.get(self.path, 0) + 1
+        if self.path == '/down.csv' or (self.path == '/flaky.csv' and count <= 2):
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == ETAG or self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(CSV)))
+        self.end_headers()
+        self.wfile.write(CSV)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests = {}
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def session():
+    session = make_session(backoff=0)
+    yield session
+    session.close()
+
+
+def test_first_download_returns_validators(server, session):
+    result = fetch_source(session, 'a', server + '/a.csv')
+    assert result.status == 200
+    assert result.frame['country'].tolist() == ['US', 'India']
+    assert (result.etag, result.last_modified, result.nbytes) == (ETAG, LAST_MODIFIED, len(CSV))
+
+
+@pytest.mark.parametrize('validators', [{'etag': ETAG}, {'last_modified': LAST_MODIFIED},
+                                        {'etag': ETAG, 'last_modified': LAST_MODIFIED}],
+                         ids=['etag', 'last modified', 'both'])
+def test_unchanged_source_is_not_parsed(server, session, validators):
+    def parse(content):
+        raise AssertionError('a 304 has no body to parse')
+
+    result = fetch_source(session, 'a', server + '/a.csv', validators, parse=parse)
+    assert (result.status, result.frame, result.nbytes) == (304, None, 0)
+    # the stored validators are kept for the next request
+    assert (result.etag, result.last_modified) == (validators.get('etag'), validators.get('last_modified'))
+
+
+def test_stale_validators_download_again(server, session):
+    result = fetch_source(session, 'a', server + '/a.csv', {'etag': '"v0"'})
+    assert (result.status, result.etag) == (200, ETAG)
+
+
+def test_server_errors_are_retried(server, session):
+    result = fetch_source(session, 'flaky', server + '/flaky.csv')
+    assert result.status == 200
+    assert Handler.requests['/flaky.csv'] == 3
+
+
+def test_retries_give_up(server, session):
+    with pytest.raises(requests.exceptions.RetryError):
+        fetch_source(session, 'down', server + '/down.csv')
+    # the first request and RETRIES retries
+    assert Handler.requests['/down.csv'] == 4
+
+
+def test_fetch_sources_mixes_modified_and_unchanged(server):
+    results = fetch_sources({'a': server + '/a.csv', 'b': server + '/b.csv'}, {'a': {'etag': ETAG}},
+                            parsers={'b': lambda content: content.decode()})
+    assert (results['a'].status, results['a'].frame) == (304, None)
+    assert (results['b'].status, results['b'].frame) == (200, CSV.decode())
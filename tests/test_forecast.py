@@ -0,0 +1,77 @@
+### incremental model updates: a small drift keeps the order, a large one searches again
+import numpy as np
+import pytest
+
+import forecast
+from forecast import (COUNTRY_PARAMS, DRIFT_THRESHOLD, fit_or_update, forecast_drift, model_key, save_model,
+                      write_latest)
+
+N_FIT = 60
+
+
+@pytest.fixture
+def fits(tmp_path, monkeypatch):
+    # models go to a temp dir, the orders searched by fit_model are counted
+    monkeypatch.setattr(forecast, 'MODEL_DIR', str(tmp_path))
+    calls = []
+    fit_model = forecast.fit_model
+
+    def counted(series, params=None):
+        calls.append(len(series))
+        return fit_model(series, params)
+    monkeypatch.setattr(forecast, 'fit_model', counted)
+    return calls
+
+
+def trend(n, seed=0):
+    # a steady cumulative count with a little noise
+    return 1000.0 + 50.0 * np.arange(n) + np.random.default_rng(seed).normal(scale=2.0, size=n)
+
+
+def fit_latest(series, name='test'):
+    model, info = fit_or_update(series[:N_FIT], COUNTRY_PARAMS, name)
+    write_latest(name, model_key(series[:N_FIT], COUNTRY_PARAMS), info)
+    save_model(model_key(series[:N_FIT], COUNTRY_PARAMS), model)
+    return model, info
+
+
+def test_small_drift_updates_the_model(fits):
+    series = trend(N_FIT + 10)
+    model, info = fit_latest(series)
+    assert forecast_drift(model, series[N_FIT:]) <= DRIFT_THRESHOLD
+    updated, update_info = fit_or_update(series, COUNTRY_PARAMS, 'test')
+    # only the first fit searched an order
+    assert fits == [N_FIT]
+    assert update_info['updates'] == 1
+    assert update_info['n_obs'] == len(series)
+    assert update_info['order'] == info['order'] == list(updated.order)
+    assert update_info['searched_at'] == info['searched_at']
+    assert update_info['drift'] <= DRIFT_THRESHOLD
+
+
+def test_large_drift_refits(fits):
+    series = trend(N_FIT + 10)
+    # the count jumps far off the trend after the fitted days
+    series[N_FIT:] *= 3
+    model, info = fit_latest(series)
+    assert forecast_drift(model, series[N_FIT:]) > DRIFT_THRESHOLD
+    refit, refit_info = fit_or_update(series, COUNTRY_PARAMS, 'test')
+    assert fits == [N_FIT, N_FIT + 10]
+    assert refit_info['updates'] == 0
+    assert refit_info['n_obs'] == len(series)
+    assert refit_info['searched_at'] >= info['searched_at']
+
+
+def test_old_search_refits(fits, monkeypatch):
+    series = trend(N_FIT + 10)
+    fit_latest(series)
+    monkeypatch.setattr(forecast, 'REFIT_SECONDS', 0)
+    assert fit_or_update(series, COUNTRY_PARAMS, 'test')[1]['updates'] == 0
+    assert fits == [N_FIT, N_FIT + 10]
+
+
+def test_other_series_refits(fits):
+    # the latest model was fitted on another series, its key does not match the prefix
+    fit_latest(trend(N_FIT + 10, seed=1))
+    assert fit_or_update(trend(N_FIT + 10), COUNTRY_PARAMS, 'test')[1]['updates'] == 0
+    assert fits == [N_FIT, N_FIT + 10]
@@ -0,0 +1,139 @@
+### daily transforms and revision policies against the per-country pandas transforms they replace
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from metrics import (REVISION_POLICIES, abs_daily_values, centered_mean, clipped_daily_values, daily_values, ewma,
+                     revisions, spread_daily_values, trailing_mean, window_sums)
+
+# cumulative totals of three countries, the first is revised down on day 3 and the third on days 2 and 5
+CUBE = np.array([
+    [0, 10, 25, 20, 30, 30, 45],
+    [0, 0, 1, 3, 3, 8, 9],
+    [5, 9, 7, 12, 15, 11, 16],
+])
+
+# the per-country pandas transform of each daily function
+PANDAS = {
+    daily_values: lambda s: s.diff().fillna(0),
+    # the old GovEx Doses_daily column
+    abs_daily_values: lambda s: s.sub(s.shift().fillna(0)).abs(),
+    clipped_daily_values: lambda s: s.diff().fillna(0).clip(lower=0),
+    spread_daily_values: lambda s: s[::-1].cummin()[::-1].diff().fillna(0),
+}
+
+
+def long_frame(cube):
+    return pd.DataFrame({'country': np.repeat(np.arange(len(cube)), cube.shape[1]), 'value': cube.ravel()})
+
+
+@pytest.mark.parametrize('fn', list(PANDAS), ids=lambda fn: fn.__name__)
+def test_matches_per_country_transform(fn):
+    expected = long_frame(CUBE).groupby('country')['value'].transform(PANDAS[fn])
+    np.testing.assert_array_equal(fn(CUBE).ravel(), expected.to_numpy())
+
+
+# daily values of the first country under each policy, its total drops by 5 on day 3
+POLICY_DAYS = {
+    'abs': [0, 10, 15, 5, 10, 0, 15],
+    'clip': [0, 10, 15, 0, 10, 0, 15],
+    'spread': [0, 10, 10, 0, 10, 0, 15],
+    'flag': [0, 10, 15, -5, 10, 0, 15],
+}
+
+
+@pytest.mark.parametrize('policy', sorted(POLICY_DAYS))
+def test_policies(policy):
+    assert REVISION_POLICIES[policy](CUBE)[0].tolist() == POLICY_DAYS[policy]
+
+
+def test_policy_from_env():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = 'import metrics; print(sorted(set(fn.__name__ for fn in metrics.SERIES.values())))'
+    run = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True,
+                         env=dict(os.environ, COVID_APP_REVISION_POLICY='spread'))
+    assert run.stdout.strip() == "['spread_daily_values']"
+    run = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True,
+                         env=dict(os.environ, COVID_APP_REVISION_POLICY='drop'))
+    assert run.returncode != 0
+    assert 'COVID_APP_REVISION_POLICY=drop is not one of: abs, clip, flag, spread' in run.stderr
+
+
+def test_flag_keeps_negative_days_and_lists_them():
+    assert daily_values(CUBE)[0, 3] == -5
+    assert revisions(CUBE).tolist() == [[0, 3], [2, 2], [2, 5]]
+
+
+def test_abs_counts_the_first_report():
+    assert abs_daily_values(CUBE)[:, 0].tolist() == [0, 0, 5]
+    assert abs_daily_values(CUBE)[0].tolist() == [0, 10, 15, 5, 10, 0, 15]
+
+
+def test_clip_drops_the_revision():
+    clipped = clipped_daily_values(CUBE)
+    assert (clipped >= 0).all()
+    assert clipped[0].tolist() == [0, 10, 15, 0, 10, 0, 15]
+    # the days after the revision count twice, the total overshoots by the drop
+    assert clipped[0].sum() == CUBE[0, -1] + 5
+
+
+def test_spread_keeps_the_final_total():
+    spread = spread_daily_values(CUBE)
+    assert (spread >= 0).all()
+    # the drop of 5 is taken back from the day before it
+    assert spread[0].tolist() == [0, 10, 10, 0, 10, 0, 15]
+    # the capped first day plus the daily values ends on the reported final total
+    capped = np.minimum.accumulate(CUBE[:, ::-1], axis=1)[:, ::-1]
+    np.testing.assert_array_equal(capped[:, 0] + spread.sum(axis=1), CUBE[:, -1])
+    np.testing.assert_array_equal(spread[1], daily_values(CUBE)[1])
+
+
+def test_spread_of_a_drop_reaching_back_several_days():
+    cumulative = np.array([[0, 10, 20, 30, 40, 12, 50]])
+    spread = spread_daily_values(cumulative)
+    assert spread.tolist() == [[0, 10, 2, 0, 0, 0, 38]]
+    assert spread.sum() == cumulative[0, -1]
+
+
+def test_transforms_keep_float_nan_rows_apart():
+    # rows are independent, a nan in one country does not leak into another
+    cube = np.array([[0.0, 1.0, np.nan, 3.0], [0.0, 2.0, 4.0, 3.0]])
+    for fn in PANDAS:
+        np.testing.assert_array_equal(fn(cube)[1], fn(cube[1:])[0])
+
+
+### smoothing against pandas rolling and ewm, per row
+# daily values with a nan day at the start, one inside and two in a row
+DAILY = np.array([
+    [1.0, 4.0, 2.0, 8.0, 5.0, 7.0, 3.0, 6.0, 9.0, 0.0, 2.0, 4.0],
+    [np.nan, 3.0, 5.0, np.nan, 2.0, 6.0, 1.0, 8.0, 3.0, 5.0, 7.0, 2.0],
+    [2.0, 2.0, 6.0, 4.0, 1.0, 3.0, 9.0, np.nan, np.nan, 4.0, 6.0, 5.0],
+])
+
+PANDAS_SMOOTHERS = {
+    trailing_mean: lambda s, w: s.rolling(w).mean(),
+    centered_mean: lambda s, w: s.rolling(w, center=True).mean(),
+    ewma: lambda s, w: s.ewm(span=w, adjust=False, ignore_na=True).mean(),
+}
+
+
+@pytest.mark.parametrize('window', [1, 2, 4, 7, 12, 13])
+@pytest.mark.parametrize('fn', list(PANDAS_SMOOTHERS), ids=lambda fn: fn.__name__)
+def test_smoothing_matches_pandas(fn, window):
+    expected = np.array([PANDAS_SMOOTHERS[fn](pd.Series(row), window).to_numpy() for row in DAILY])
+    np.testing.assert_allclose(fn(DAILY, window), expected, rtol=1e-12, equal_nan=True)
+    # a single row gives the same values as in the batch
+    np.testing.assert_allclose(fn(DAILY[1], window), expected[1], rtol=1e-12, equal_nan=True)
+
+
+def test_window_sums_of_nan_windows():
+    sums = window_sums(DAILY, 3)
+    np.testing.assert_allclose(sums, np.array([pd.Series(row).rolling(3).sum().to_numpy() for row in DAILY]),
+                               equal_nan=True)
+    # every window holding the nan days of the third row is nan, the ones after them are not
+    assert np.isnan(sums[2, 7:11]).all()
+    assert sums[2, 11] == 4.0 + 6.0 + 5.0
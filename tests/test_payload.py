@@ -0,0 +1,84 @@
+### compact encoding of the figure traces
+import numpy as np
+import pandas as pd
+import pytest
+
+from payload import DAY_MS, compact_spaced_trace, compact_trace, lttb, round_significant
+
+
+def noisy(n, seed=0):
+    return np.cumsum(np.random.default_rng(seed).normal(size=n))
+
+
+@pytest.mark.parametrize('n, n_out', [(1000, 100), (1000, 3), (101, 50), (10, 9)])
+def test_lttb_keeps_the_ends_and_the_length(n, n_out):
+    x = np.arange(n, dtype=float)
+    keep = lttb(x, noisy(n), n_out)
+    assert len(keep) == n_out
+    assert keep[0] == 0 and keep[-1] == n - 1
+    assert (np.diff(keep) > 0).all()
+
+
+def test_lttb_keeps_a_spike():
+    y = np.zeros(1000)
+    y[517] = 50.0
+    assert 517 in lttb(np.arange(1000, dtype=float), y, 80)
+
+
+@pytest.mark.parametrize('n_out', [2, 10, 20])
+def test_lttb_short_series_are_kept_whole(n_out):
+    # nothing to reduce, or too few points to keep both ends and a bucket
+    np.testing.assert_array_equal(lttb(np.arange(10.0), noisy(10), n_out), np.arange(10))
+
+
+def test_round_significant():
+    rounded = round_significant([123456.0, 0.0012345, -98.7654, 0.0], 3)
+    np.testing.assert_array_equal(rounded, [123000.0, 0.00123, -98.8, 0.0])
+    assert rounded.dtype == np.float64
+
+
+def test_round_significant_integers_only_when_all_whole():
+    rounded = round_significant([1234.4, 5678.6, 0.0], 4)
+    assert rounded.dtype == np.int64
+    assert rounded.tolist() == [1234, 5679, 0]
+    # one value that is not whole keeps the floats
+    assert round_significant([1234.4, 5678.6, 0.5], 4).dtype == np.float64
+    # and so does a nan day
+    assert round_significant([1234.0, np.nan], 4).dtype == np.float64
+    # large counts round to whole numbers
+    assert round_significant([1234567.0], 3).tolist() == [1230000]
+
+
+def test_compact_spaced_trace_realigns_on_the_last_day():
+    trace = {'y': np.arange(1000.0), 'x0': '2020-01-22', 'dx': DAY_MS}
+    compact = compact_spaced_trace(trace, 300)
+    # a step of 4 counted back from the last day starts 3 days later
+    assert compact['x0'] == '2020-01-25'
+    assert compact['dx'] == 4 * DAY_MS
+    assert len(compact['y']) == 250
+    assert compact['y'][0] == 3 and compact['y'][-1] == 999
+    last = pd.Timestamp(compact['x0']) + pd.Timedelta(milliseconds=(len(compact['y']) - 1) * compact['dx'])
+    assert last == pd.Timestamp('2020-01-22') + pd.Timedelta(days=999)
+    # the input trace is left alone
+    assert trace['x0'] == '2020-01-22' and len(trace['y']) == 1000
+
+
+def test_compact_spaced_trace_numeric_axis():
+    compact = compact_spaced_trace({'y': np.arange(10.0), 'x0': 100, 'dx': 2}, 3)
+    assert compact['x0'] == 100 + 1 * 2
+    assert compact['dx'] == 8
+    assert compact['y'].tolist() == [1, 5, 9]
+
+
+def test_compact_spaced_trace_short_trace_keeps_the_axis():
+    compact = compact_spaced_trace({'y': [1.5, 2.0, 3.0], 'x0': '2021-03-01', 'dx': DAY_MS}, 300)
+    assert compact['x0'] == '2021-03-01' and compact['dx'] == DAY_MS
+    assert compact['y'].tolist() == [1.5, 2.0, 3.0]
+
+
+def test_compact_trace_daily_dates_become_x0_dx():
+    dates = pd.date_range('2021-01-01', periods=30).strftime('%Y-%m-%d').to_numpy()
+    compact = compact_trace({'x': dates, 'y': np.arange(30.0)})
+    assert 'x' not in compact
+    assert compact['x0'] == '2021-01-01' and compact['dx'] == DAY_MS
+    assert compact['y'].dtype == np.int64
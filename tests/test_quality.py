@@ -0,0 +1,103 @@
+### quality checks and repair on small hand-built series
+import numpy as np
+
+from metrics import daily_values
+from quality import (BASELINE_DAYS, STALE_DAYS, check_series, quality_issues, quality_report, repair,
+                     selected_flags, stale_days)
+
+DAYS = 60
+SPIKE, DIP, REVISED, STALE, ZERO = range(5)
+
+
+def cube():
+    # every row grows by 10 a day, each breaks it in one way
+    values = np.tile(np.arange(DAYS) * 10, (5, 1))
+    # one day reports 500 new cases
+    values[SPIKE, 40:] += 490
+    # three days fall 50 below the day before them, then the series goes on as before
+    values[DIP, 20:23] = values[DIP, 19] - 50
+    # a revision of 200 that the series never grows back over
+    values[REVISED, 45:] -= 200
+    # no change over the last 20 days
+    values[STALE, 40:] = values[STALE, 39]
+    values[ZERO] = 0
+    return values
+
+
+def test_check_series_flags_dips_revisions_and_spikes():
+    flags = check_series({'cases': cube()})['cases']
+    assert flags['negative'].tolist() == [[DIP, 20], [REVISED, 45]]
+    assert flags['outlier'].tolist() == [[SPIKE, 40]]
+
+
+def test_small_counts_are_no_outliers():
+    # ten times the baseline but below MIN_OUTLIER
+    values = np.arange(DAYS)[None, :].copy()
+    values[0, 40:] += 20
+    assert check_series({'cases': values})['cases']['outlier'].size == 0
+
+
+def test_stale_days():
+    days = stale_days(cube())
+    assert 20 >= STALE_DAYS
+    assert days[STALE] == 20
+    assert days[[SPIKE, DIP, REVISED]].tolist() == [0, 0, 0]
+    # a series that never changed counts the full length
+    assert days[ZERO] == DAYS
+
+
+def test_report_and_issues():
+    values = cube()
+    flags = check_series({'cases': values})
+    report = quality_report(flags, {'cases': values}, ['spike', 'dip', 'revised', 'stale', 'zero'])
+    assert report['cases_negative'].tolist() == [0, 1, 1, 0, 0]
+    assert report['cases_outlier'].tolist() == [1, 0, 0, 0, 0]
+    # an all zero series is not stale
+    assert report['cases_stale_days'].tolist() == [0, 0, 0, 20, 0]
+    assert quality_issues(report) == {'spike': {'cases_outlier': 1}, 'dip': {'cases_negative': 1},
+                                      'revised': {'cases_negative': 1}, 'stale': {'cases_stale_days': 20}}
+
+
+def test_selected_flags():
+    flags = check_series({'cases': cube()})['cases']
+    # positions in the selection, rows that are not in the dataset are None
+    assert selected_flags(flags, [REVISED, None, SPIKE]) == [(0, 45, 'negative'), (2, 40, 'outlier')]
+    assert selected_flags(flags, [STALE]) == []
+
+
+def test_repair_fills_a_dip():
+    values = cube()
+    repaired = repair(values, check_series({'cases': values})['cases'])
+    # the dip days keep the total before them, the days after it are untouched
+    assert repaired[DIP, 19:24].tolist() == [190, 190, 190, 190, 230]
+    np.testing.assert_array_equal(repaired[DIP, 23:], values[DIP, 23:])
+    assert (daily_values(repaired[DIP]) >= 0).all()
+
+
+def test_repair_spreads_a_spike():
+    values = cube()
+    repaired = repair(values, check_series({'cases': values})['cases'])
+    daily = daily_values(repaired[SPIKE])
+    # the spike day is back on its baseline and the excess went to the days before it
+    assert daily[40] == 10
+    assert daily[40 - BASELINE_DAYS:40].sum() == 10 * BASELINE_DAYS + 490
+    np.testing.assert_array_equal(daily[41:], 10)
+    np.testing.assert_array_equal(daily[1:40 - BASELINE_DAYS], 10)
+    assert repaired[SPIKE, -1] == values[SPIKE, -1]
+
+
+def test_repair_caps_a_permanent_revision():
+    values = cube()
+    repaired = repair(values, check_series({'cases': values})['cases'])
+    # not a dip, the days before it are capped by the lower total after it
+    assert values[REVISED, -1] < values[REVISED, 44]
+    assert repaired[REVISED, :45].tolist() == np.minimum(values[REVISED, :45], 250).tolist()
+    np.testing.assert_array_equal(repaired[REVISED, 45:], values[REVISED, 45:])
+    assert (daily_values(repaired[REVISED]) >= 0).all()
+
+
+def test_repair_leaves_clean_rows_and_dtype():
+    values = cube().astype(np.int32)
+    repaired = repair(values, check_series({'cases': values})['cases'])
+    assert repaired.dtype == np.int32
+    np.testing.assert_array_equal(repaired[[STALE, ZERO]], values[[STALE, ZERO]])
@@ -1,204 +1,50 @@
 ### import libraries
+import json
+import os
+import sys
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
-from datetime import datetime
+from dash.dependencies import ClientsideFunction, Input, Output
+from dash.exceptions import PreventUpdate
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import pmdarima as pm
+from plotly.utils import PlotlyJSONEncoder
+
+from dataset import (DEFAULT_COUNTRIES, PIPELINE_SETTINGS, RANK_COLUMNS, add_swap_hook, bundle_command,
+                     country_population, current_dataset, dataset_version, load_dataset, memory_report, start_refresher,
+                     top_countries, version_cache)
+from figure_cache import cached_figure, stats as figure_cache_stats
+from forecast import MAX_FORECAST_COUNTRIES, MAX_HORIZON, country_forecast, get_forecast, horizon
+from metrics import SERIES, SMOOTHING, country_rows, metric_rows, world_values
+from payload import compact_figures, daily_axis, payload_mode
+from quality import quality_issues, selected_flags
+
+### offline build step
+# `python -m vaccine_app build` writes and publishes the dataset bundle the web processes load,
+# `python -m vaccine_app compare OLD NEW` diffs two bundles. see dataset.py
+if __name__ == "__main__" and sys.argv[1:2] in (['build'], ['compare']):
+    sys.exit(bundle_command(sys.argv[1:]))
 
 ### load data from Johns Hopkins github repository
-death_df = pd.read_csv(
-    'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv')
-confirmed_df = pd.read_csv(
-    'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv')
-recovered_df = pd.read_csv(
-    'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv')
-country_df = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/web-data/data/cases_country.csv')
-
-country_vax_df = pd.read_csv(
-    'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables/vaccine_data/global_data/vaccine_data_global.csv')
-global_vax_admin_df = pd.read_csv(
-    'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables/vaccine_data/global_data/time_series_covid19_vaccine_doses_admin_global.csv')
-global_vax_full_df = pd.read_csv(
-    'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables/vaccine_data/global_data/time_series_covid19_vaccine_global.csv')
-
-### load population data from local csv
-pop_raw = pd.read_csv("data/population_by_country_2020.csv")
-
-### data cleaning
-# renaming the df column names to lowercase
-country_df.columns = map(str.lower, country_df.columns)
-confirmed_df.columns = map(str.lower, confirmed_df.columns)
-death_df.columns = map(str.lower, death_df.columns)
-recovered_df.columns = map(str.lower, recovered_df.columns)
-
-# changing province/state to state and country/region to country
-confirmed_df = confirmed_df.rename(columns={'province/state': 'state', 'country/region': 'country'})
-recovered_df = confirmed_df.rename(columns={'province/state': 'state', 'country/region': 'country'})
-death_df = death_df.rename(columns={'province/state': 'state', 'country/region': 'country'})
-country_df = country_df.rename(columns={'country_region': 'country'})
-
-country_vax_df = country_vax_df.rename(columns={'Province_State': 'state', 'Country_Region': 'country'})
-global_vax_admin_df = global_vax_admin_df.rename(columns={'Province_State': 'state', 'Country_Region': 'country'})
-global_vax_full_df = global_vax_full_df.rename(columns={'Province_State': 'state', 'Country_Region': 'country'})
-
-# merge & drop duplicates to get lat & long for each country vax data
-full_country_df = pd.merge(country_df, country_vax_df, on='country')
-full_country_df = full_country_df.drop_duplicates(subset=['country'])
-full_country_df['People_fully_vaccinated'] = full_country_df['People_fully_vaccinated'].fillna(0)
-
-### dataframe has country data as well as that country split into states
-# drop the ones with states
-global_vax_full_df = global_vax_full_df.drop(global_vax_full_df[pd.notna(global_vax_full_df['state'])].index)
-
-# world vax data time series
-world_vax_ts = global_vax_full_df[global_vax_full_df['country'] == 'World']
-
-# population data
-pop_raw = pop_raw.rename(columns={"Country(or dependency)": "country", "Population(2020)": "population"})
-pop = pop_raw[['country', 'population']]
-global_vax_full_df = pd.merge(global_vax_full_df, pop, on='country', how='left')
-
-full_country_df = pd.merge(full_country_df, pop, on='country', how='left')
-full_country_df['Percent_fully_vaccinated'] = (
-            full_country_df['People_fully_vaccinated'] / full_country_df['population'])
-full_country_df['Percent_fully_vaccinated'] = full_country_df['Percent_fully_vaccinated'].fillna(0)
-
-### calculations
-# total number of confirmed, death and recovered cases
-confirmed_total = int(country_df['confirmed'].sum())
-deaths_total = int(country_df['deaths'].sum())
-recovered_total = int(country_df['recovered'].sum())
-active_total = int(country_df['active'].sum())
-
-doses_admin_total = country_vax_df.loc[country_vax_df['country'] == 'World']['Doses_admin']
-full_vax_total = country_vax_df.loc[country_vax_df['country'] == 'World']['People_fully_vaccinated']
-
-### country daily data
-# doses
-global_vax_full_df['Doses_daily'] = global_vax_full_df.groupby(['country'])['Doses_admin'].transform(
-    lambda s: s.sub(s.shift().fillna(0)).abs())
-# full vax
-global_vax_full_df['fully_vaccinated_daily'] = global_vax_full_df.groupby(['country'])[
-    'People_fully_vaccinated'].transform(lambda s: s.sub(s.shift().fillna(0)).abs())
-
-### world daily data
-# doses
-world_vax_ts['Doses_daily'] = world_vax_ts['Doses_admin'].transform(lambda s: s.sub(s.shift().fillna(0)).abs())
-# full vax
-world_vax_ts['fully_vaccinated_daily'] = world_vax_ts['People_fully_vaccinated'].transform(
-    lambda s: s.sub(s.shift().fillna(0)).abs())
-
-world_vax_ts['Percent_fully_vaccinated'] = world_vax_ts['People_fully_vaccinated'] / pop['population'].sum()
-world_vax_ts['Percent_fully_daily'] = world_vax_ts['Percent_fully_vaccinated'].transform(
-    lambda s: s.sub(s.shift().fillna(0)).abs())
-
-### world ARIMA modeling % vax
-y = world_vax_ts[['Date', 'Percent_fully_vaccinated']]
-val = y['Percent_fully_vaccinated'].values
-model = pm.auto_arima(val, start_p=1, start_q=1,
-                      test='adf',  # use adftest to find optimal 'd'
-                      max_p=3, max_q=3,  # maximum p and q
-                      m=1,  # frequency of series
-                      d=None,  # let model determine 'd'
-                      seasonal=False,  # No Seasonality
-                      start_P=0,
-                      D=0,
-                      trace=True,
-                      error_action='ignore',
-                      suppress_warnings=True,
-                      stepwise=True)
-
-# last update
-u1 = country_df.iloc[0]['last_update']
-u2 = datetime.strptime(u1, "%Y-%m-%d %H:%M:%S")
-update = datetime.strftime(u2, "%b %d %Y %H:%M:%S")
-
-### country covid data
-# cases x and y
-df_list = [confirmed_df]
-for i, df in enumerate(df_list):
-    case_x_data = np.array(list(df.iloc[:, 20:].columns))
-case_x_data = pd.to_datetime(case_x_data)
-
-
-def case_y_axis(country, daily=0):
-    df_list = [confirmed_df]
-    for i, df in enumerate(df_list):
-        case_y_data = np.sum(np.asarray(df[df['country'] == country].iloc[:, 20:]), axis=0)
-
-        new = [0]
-        for i in range(1, len(case_y_data)):
-            x = case_y_data[i] - case_y_data[i - 1]
-            new.append(x)
-
-    return new if daily == 1 else case_y_data
-
-
-# deaths x and y
-df_list = [death_df]
-for i, df in enumerate(df_list):
-    death_x_data = np.array(list(df.iloc[:, 20:].columns))
-death_x_data = pd.to_datetime(death_x_data)
-
-
-def death_y_axis(country, daily=0):
-    df_list = [death_df]
-    for i, df in enumerate(df_list):
-        death_y_data = np.sum(np.asarray(df[df['country'] == country].iloc[:, 20:]), axis=0)
-
-        new = [0]
-        for i in range(1, len(death_y_data)):
-            x = death_y_data[i] - death_y_data[i - 1]
-            new.append(x)
-
-    return new if daily == 1 else death_y_data
-
-
-### worldwide covid data
-# cases x and y
-df_list = [confirmed_df]
-for i, df in enumerate(df_list):
-    total_case_x_data = np.array(list(df.iloc[:, 20:].columns))
-total_case_x_data = pd.to_datetime(total_case_x_data)
-
-
-def total_case_y_axis(daily=0):
-    df_list = [confirmed_df]
-    for i, df in enumerate(df_list):
-        total_case_y_data = np.sum(np.asarray(df.iloc[:, 20:]), axis=0)
-
-        new = [0]
-        for i in range(1, len(total_case_y_data)):
-            x = total_case_y_data[i] - total_case_y_data[i - 1]
-            new.append(x)
-
-    return new if daily == 1 else total_case_y_data
-
-
-# deaths x and y
-df_list = [death_df]
-for i, df in enumerate(df_list):
-    total_death_x_data = np.array(list(df.iloc[:, 20:].columns))
-total_death_x_data = pd.to_datetime(total_death_x_data)
+# cleaned into a versioned dataset (see dataset.py) that is refreshed in the background
+load_dataset()
+start_refresher()
 
 
-def total_death_y_axis(daily=0):
-    df_list = [death_df]
-    for i, df in enumerate(df_list):
-        total_death_y_data = np.sum(np.asarray(df.iloc[:, 20:]), axis=0)
+# mark the days flagged by the quality checks on the country grid, see quality.py
+QUALITY_MARKERS = os.environ.get('COVID_APP_QUALITY_MARKERS', '') not in ('', '0')
 
-        new = [0]
-        for i in range(1, len(total_death_y_data)):
-            x = total_death_y_data[i] - total_death_y_data[i - 1]
-            new.append(x)
 
-    return new if daily == 1 else total_death_y_data
+# figures are cached per data version, payload encoding, pipeline settings, markers and
+# the webgl threshold, which switches the country grid between scatter and scattergl traces
+def figure_version():
+    return (dataset_version() + payload_mode() + PIPELINE_SETTINGS + ('-flags' if QUALITY_MARKERS else '')
+            + '-gl%d' % WEBGL_THRESHOLD)
 
 
 ### app colors. Dark blue and grey color scheme
@@ -217,16 +63,29 @@ def get_options(list_countries):
     return dict_list
 
 
-# clean country list
-country_list = country_vax_df.drop(country_vax_df[pd.notna(country_vax_df['state'])].index)
-country_list = country_list[country_list['country'] != 'World']
-country_list = country_list[country_list['country'] != 'Kosovo']
-country_list = country_list[country_list['country'] != 'US (Aggregate)']
-
 ####################################### app UI #######################################
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SOLAR])
 server = app.server
 
+
+# worker stats and the quality findings, only served with COVID_APP_DEBUG_ROUTES=1
+DEBUG_ROUTES = os.environ.get('COVID_APP_DEBUG_ROUTES', '') not in ('', '0')
+if DEBUG_ROUTES:
+    # hit / miss counters of the figure cache in this worker
+    @server.route('/_figure-cache')
+    def figure_cache_report():
+        return figure_cache_stats()
+
+    # bytes held by the current dataset in this worker
+    @server.route('/_memory')
+    def dataset_memory_report():
+        return memory_report(current_dataset())
+
+    @server.route('/_quality')
+    def dataset_quality_report():
+        ds = current_dataset()
+        return {'version': ds.version, 'countries': quality_issues(ds.quality)}
+
 PLOTLY_LOGO = "https://images.plot.ly/logo/new-branding/plotly-logomark.png"
 
 navbar = dbc.Navbar(
@@ -246,582 +105,529 @@ navbar = dbc.Navbar(
     dark=True,
 )
 
-app.layout = html.Div(
-    style={'backgroundColor': colors['background'], 'height': 3000},
-    children=[
-        html.Div(id="page-container", children=[navbar]),
-
-        html.Div(id="card-container",
-                 children=[
-                     dbc.Card(
-                         # last update datetime
-                         dbc.CardBody(
-                             [
-                                 html.P("Last Update:", className="card-title"),
-                                 html.P(
-                                     str(update)
-                                 ),
-                             ]
-                         ),
-                         style={'width': '16%', 'backgroundColor': colors['charts'], 'color': colors['text'],
-                                'margin': 5, 'text-indent': 5},
-                     ),
-                     dbc.Card(
-                         # world dose data today
-                         dbc.CardBody(
-                             [
-                                 html.H4("{:,}".format(int(doses_admin_total)), className="card-title"),
-                                 html.H5(
-                                     "Doses"
-                                 ),
-                             ]
-                         ),
-                         style={'width': '20%', 'backgroundColor': colors['charts'], 'color': 'lightgreen', 'margin': 5,
-                                'text-indent': 5},
-                     ),
-                     dbc.Card(
-                         # world fully vax data today
-                         dbc.CardBody(
-                             [
-                                 html.H4("{:,}".format(int(full_vax_total)), className="card-title"),
-                                 html.H5(
-                                     "Fully Vaccinated"
-                                 ),
-                             ]
-                         ),
-                         style={'width': '20%', 'backgroundColor': colors['charts'], 'color': 'lightgreen', 'margin': 5,
-                                'text-indent': 5},
-                     ),
-                     dbc.Card(
-                         # world case data today
-                         dbc.CardBody(
-                             [
-                                 html.H4("{:,}".format(confirmed_total), className="card-title"),
-                                 html.H5(
-                                     "Cases"
-                                 ),
-                             ]
-                         ),
-                         style={'width': '20%', 'backgroundColor': colors['charts'], 'color': 'red', 'margin': 5,
-                                'text-indent': 5},
-                     ),
-                     dbc.Card(
-                         # world death data today
-                         dbc.CardBody(
-                             [
-                                 html.H4("{:,}".format(deaths_total), className="card-title"),
-                                 html.H5(
-                                     "Deaths"
+
+### cards with the world totals of the current data version
+def make_cards(ds):
+    return [
+        dbc.Card(
+            # last update datetime
+            dbc.CardBody(
+                [
+                    html.P("Last Update:", className="card-title"),
+                    html.P(
+                        str(ds.update)
+                    ),
+                ]
+            ),
+            style={'width': '16%', 'backgroundColor': colors['charts'], 'color': colors['text'],
+                   'margin': 5, 'text-indent': 5},
+        ),
+        dbc.Card(
+            # world dose data today
+            dbc.CardBody(
+                [
+                    html.H4("{:,}".format(ds.doses_admin_total), className="card-title"),
+                    html.H5(
+                        "Doses"
+                    ),
+                ]
+            ),
+            style={'width': '20%', 'backgroundColor': colors['charts'], 'color': 'lightgreen', 'margin': 5,
+                   'text-indent': 5},
+        ),
+        dbc.Card(
+            # world fully vax data today
+            dbc.CardBody(
+                [
+                    html.H4("{:,}".format(ds.full_vax_total), className="card-title"),
+                    html.H5(
+                        "Fully Vaccinated"
+                    ),
+                ]
+            ),
+            style={'width': '20%', 'backgroundColor': colors['charts'], 'color': 'lightgreen', 'margin': 5,
+                   'text-indent': 5},
+        ),
+        dbc.Card(
+            # world case data today
+            dbc.CardBody(
+                [
+                    html.H4("{:,}".format(ds.confirmed_total), className="card-title"),
+                    html.H5(
+                        "Cases"
+                    ),
+                ]
+            ),
+            style={'width': '20%', 'backgroundColor': colors['charts'], 'color': 'red', 'margin': 5,
+                   'text-indent': 5},
+        ),
+        dbc.Card(
+            # world death data today
+            dbc.CardBody(
+                [
+                    html.H4("{:,}".format(ds.deaths_total), className="card-title"),
+                    html.H5(
+                        "Deaths"
+                    ),
+                ]
+            ),
+            style={'width': '20%', 'backgroundColor': colors['charts'], 'color': 'red', 'margin': 5,
+                   'text-indent': 5},
+        ),
+    ]
+
+
+def serve_layout():
+    # called on every page load, so the cards and options follow the current data version
+    ds = current_dataset()
+    return html.Div(
+        style={'backgroundColor': colors['background'], 'height': 3000},
+        children=[
+            html.Div(id="page-container", children=[navbar]),
+
+            html.Div(id="card-container", children=make_cards(ds)),
+            html.Div(id="map-row", children=
+            [
+                html.Div(style={'backgroundColor': colors['charts'], 'margin': 5, 'height': 600, 'display': 'inline-block'},
+                         children=
+                         [
+                             # select data for bar & map
+                             dcc.Dropdown(
+                                 style={'width': '100%', 'backgroundColor': colors['charts'], 'color': colors['text']},
+                                 id='dataselect',
+                                 options=[
+                                     {'label': 'Doses', 'value': 'Doses_admin'},
+                                     {'label': 'People Fully Vaccinated', 'value': 'People_fully_vaccinated'},
+                                     {'label': 'Percent Fully Vaccinated', 'value': 'Percent_fully_vaccinated'},
+                                     {'label': 'Cases', 'value': 'confirmed'},
+                                     {'label': 'Deaths', 'value': 'deaths'}
+                                 ],
+                                 placeholder="Select the data",
+                                 value='Doses_admin',
+                                 clearable=False,
+                                 multi=False,
                                  ),
-                             ]
-                         ),
-                         style={'width': '20%', 'backgroundColor': colors['charts'], 'color': 'red', 'margin': 5,
-                                'text-indent': 5},
-                     ),
-                 ]),
-        html.Div(id="map-row", children=
-        [
-            html.Div(style={'backgroundColor': colors['charts'], 'margin': 5, 'height': 600, 'display': 'inline-block'},
+                             html.P("No. of Countries to Show: ",
+                                    style={'margin-left': 5, 'margin-right': 5, 'display': 'inline-block',
+                                           'color': colors['text'], 'textAlign': 'center'}
+                                    ),
+                             # input number for bar chart
+                             dcc.Input(style={'margin': 0, 'width': '50%', 'backgroundColor': colors['charts'],
+                                              'color': colors['text'], 'border-color': colors['text'], },
+                                       id="countrynumberselect", type="number", placeholder="Country Number", value=20
+                                       ),
+                             # bar chart
+                             dcc.Graph(id='bar',
+                                       style={'margin-top': 0, 'width': '100%', 'height': 527, 'display': 'inline-block'}
+                                       ),
+                         ]),
+
+                html.Div(children=
+                [
+                    # map plot
+                    dcc.Graph(id='map',
+                              style={'height': 605, 'margin-top': 5}
+                              ),
+                ]),
+
+                html.Div(style={'backgroundColor': colors['charts'], 'margin': 5, 'display': 'inline-block'},
+                         children=
+                         [
+                             # world total area chart
+                             dcc.Graph(id='world_area',
+                                       style={'height': 297, 'backgroundColor': colors['charts'], 'color': colors['text']}
+                                       ),
+                             html.Hr(style={'height': 10, 'width': '100%', 'margin-top': 0, 'margin-bottom': 0,
+                                            'backgroundColor': colors['background']}
+                                     ),
+                             # world daily area chart
+                             dcc.Graph(id='world_daily',
+                                       style={'height': 297, 'backgroundColor': colors['charts'], 'color': colors['text']}
+                                       ),
+                         ]),
+            ]),
+
+            html.Div(style={'height': 305, 'width': '99%', 'margin': 5, 'display': 'flex', 'flex-direction': 'row'},
                      children=
                      [
-                         # select data for bar & map
-                         dcc.Dropdown(
-                             style={'width': '100%', 'backgroundColor': colors['charts'], 'color': colors['text']},
-                             id='dataselect',
+                         # scatter plot
+                         dcc.Graph(id='scatter1', style={'height': 305, 'margin-right': 10, 'width': '49%',
+                                                         'justify-content': 'flex-start'},
+                                   ),
+                         # stacked bar chart
+                         dcc.Graph(id='stackbar', style={'height': 305, 'width': '49%', 'justify-content': 'flex-end'},
+                                   ),
+                     ]),
+
+            html.Div(style={'width': '99%', 'display': 'flex', 'flex-direction': 'row'}, children=
+            [
+                html.Div(style={'margin': 5, 'width': '49%', 'height': 495, 'justify-content': 'flex-start',
+                                'backgroundColor': colors['charts'], 'display': 'inline-block'}, children=
+                         [
+                             html.P("No. of Days to Forecast: ",
+                                    style={'font-size': 14, 'width': 160, 'display': 'inline-block',
+                                           'color': colors['text'], 'textAlign': 'center'}
+                                    ),
+                             # input number for arima forecast of world % vax
+                             dcc.Input(style={'width': '20%', 'backgroundColor': colors['charts'], 'color': colors['text'],
+                                              'border-color': colors['text'], },
+                                       id="numberselect", type="number", placeholder="Forecast", value=50,
+                                       min=1, max=MAX_HORIZON
+                                       ),
+                             # world % vax with arima
+                             dcc.Graph(id='% vax',
+                                       style={'height': 450, 'backgroundColor': colors['charts'], 'color': colors['text']}
+                                       ),
+                             # polls until the forecast model is ready
+                             dcc.Interval(id='model-poll', interval=5 * 1000),
+                         ]),
+
+                html.Div(style={'margin': 5, 'width': "49%", 'justify-content': 'flex-end', 'display': 'inline-block'},
+                         children=
+                         [
+                             # world doses & fully vax
+                             dcc.Graph(id='world_vax',
+                                       style={'height': 245, 'width': "100%", 'backgroundColor': colors['charts'],
+                                              'color': colors['text'], 'display': 'inline-block'}
+                                       ),
+                             # world covid cases & deaths
+                             dcc.Graph(id='world_covid',
+                                       style={'height': 245, 'width': "100%", 'backgroundColor': colors['charts'],
+                                              'color': colors['text'], 'display': 'block'}
+                                       ),
+                         ])
+            ]),
+
+            html.Div(id="filter-container", children=
+            [
+                # below map & scatter. Left side
+                # horizontal rule and Filter title
+                html.Hr(style={'height': 5, 'margin-top': 5, 'margin-bottom': 0, 'backgroundColor': colors['charts'],
+                               'display': 'block'}
+                        ),
+                html.H4("FILTERS",
+                        style={'margin-bottom': 15, 'text-indent': 0, 'color': colors['text'], 'display': 'block'}
+                        ),
+                # select the countries dropdown
+                html.P("Country:", style={'margin-bottom': 0, 'text-indent': 0, 'color': colors['text'], 'display': 'block'}
+                       ),
+                dcc.Dropdown(style={'width': '100%', 'height': 70, 'margin-bottom': 15, 'backgroundColor': colors['charts'],
+                                    'color': colors['text'], 'display': 'block'},
+                             id='countryselect',
+                             options=get_options(ds.country_list['country'].unique()),
+                             placeholder="Select a country",
+                             value=DEFAULT_COUNTRIES,
+                             clearable=False,
+                             multi=True,
+                             ),
+                # select all countries or the countries of a region
+                dcc.Dropdown(style={'width': '100%', 'margin-bottom': 15, 'backgroundColor': colors['charts'],
+                                    'color': colors['text'], 'display': 'block'},
+                             id='regionselect',
+                             options=[{'label': 'All countries', 'value': 'all'}] + get_options(ds.regions),
+                             placeholder="Select all countries or a region",
+                             multi=False
+                             ),
+                # select the metric dropdown
+                html.P("Metric:", style={'margin-bottom': 0, 'text-indent': 0, 'color': colors['text'], 'display': 'block'}
+                       ),
+                dcc.Dropdown(style={'width': '100%', 'margin-bottom': 15, 'backgroundColor': colors['charts'],
+                                    'color': colors['text'], 'display': 'block'},
+                             id='metricselect',
                              options=[
-                                 {'label': 'Doses', 'value': 'Doses_admin'},
-                                 {'label': 'People Fully Vaccinated', 'value': 'People_fully_vaccinated'},
-                                 {'label': 'Percent Fully Vaccinated', 'value': 'Percent_fully_vaccinated'},
-                                 {'label': 'Cases', 'value': 'confirmed'},
-                                 {'label': 'Deaths', 'value': 'deaths'}
+                                 {'label': 'Cumulative', 'value': 'Cumulative'},
+                                 {'label': 'Daily', 'value': 'Daily'},
+                                 {'label': 'Cumulative Per Capita', 'value': 'Cumulative Per Capita'},
+                                 {'label': 'Daily Per Capita', 'value': 'Daily Per Capita'}
                              ],
-                             placeholder="Select the data",
-                             value='Doses_admin',
+                             placeholder="Select a metric",
+                             value='Cumulative',
                              clearable=False,
-                             multi=False,
+                             multi=False
                              ),
-                         html.P("No. of Countries to Show: ",
-                                style={'margin-left': 5, 'margin-right': 5, 'display': 'inline-block',
-                                       'color': colors['text'], 'textAlign': 'center'}
-                                ),
-                         # input number for bar chart
-                         dcc.Input(style={'margin': 0, 'width': '50%', 'backgroundColor': colors['charts'],
-                                          'color': colors['text'], 'border-color': colors['text'], },
-                                   id="countrynumberselect", type="number", placeholder="Country Number", value=20
-                                   ),
-                         # bar chart
-                         dcc.Graph(id='bar',
-                                   style={'margin-top': 0, 'width': '100%', 'height': 527, 'display': 'inline-block'}
-                                   ),
-                     ]),
+                # select the smoothing dropdown
+                html.P("Smoothing:",
+                       style={'margin-bottom': 0, 'text-indent': 0, 'color': colors['text'], 'display': 'block'}
+                       ),
+                dcc.Dropdown(style={'width': '100%', 'backgroundColor': colors['charts'], 'color': colors['text'],
+                                    'display': 'block'},
+                             id='smoothselect',
+                             options=get_options(SMOOTHING),
+                             placeholder="Select a smoothing option",
+                             value='No Smoothing',
+                             clearable=False,
+                             multi=False
+                             ),
+            ]),
 
-            html.Div(children=
+            html.Div(id="country-grid", children=
             [
-                # map plot
-                dcc.Graph(id='map',
-                          style={'height': 605, 'margin-top': 5}
+                # raw series of the selected countries for the clientside mode
+                dcc.Store(id='country-series'),
+                # country doses
+                dcc.Graph(id='dose', style={'height': 400, 'width': '100%', 'margin-bottom': 10}
+                          ),
+                # country full vax
+                dcc.Graph(id='fullvax', style={'height': 400, 'width': '100%', 'margin-bottom': 10}
+                          ),
+                # country covid cases
+                dcc.Graph(id='case', style={'height': 400, 'width': '100%'}
+                          ),
+                # country covid deaths
+                dcc.Graph(id='death', style={'height': 400, 'width': '100%', }
                           ),
             ]),
 
-            html.Div(style={'backgroundColor': colors['charts'], 'margin': 5, 'display': 'inline-block'},
-                     children=
-                     [
-                         # world total area chart
-                         dcc.Graph(id='world_area',
-                                   style={'height': 297, 'backgroundColor': colors['charts'], 'color': colors['text']}
-                                   ),
-                         html.Hr(style={'height': 10, 'width': '100%', 'margin-top': 0, 'margin-bottom': 0,
-                                        'backgroundColor': colors['background']}
-                                 ),
-                         # world daily area chart
-                         dcc.Graph(id='world_daily',
-                                   style={'height': 297, 'backgroundColor': colors['charts'], 'color': colors['text']}
-                                   ),
-                     ]),
-        ]),
-
-        html.Div(style={'height': 305, 'width': '99%', 'margin': 5, 'display': 'flex', 'flex-direction': 'row'},
-                 children=
-                 [
-                     # scatter plot
-                     dcc.Graph(id='scatter1', style={'height': 305, 'margin-right': 10, 'width': '49%',
-                                                     'justify-content': 'flex-start'},
-                               ),
-                     # stacked bar chart
-                     dcc.Graph(id='stackbar', style={'height': 305, 'width': '49%', 'justify-content': 'flex-end'},
-                               ),
-                 ]),
-
-        html.Div(style={'width': '99%', 'display': 'flex', 'flex-direction': 'row'}, children=
-        [
-            html.Div(style={'margin': 5, 'width': '49%', 'height': 495, 'justify-content': 'flex-start',
-                            'backgroundColor': colors['charts'], 'display': 'inline-block'}, children=
-                     [
-                         html.P("No. of Days to Forecast: ",
-                                style={'font-size': 14, 'width': 160, 'display': 'inline-block',
-                                       'color': colors['text'], 'textAlign': 'center'}
-                                ),
-                         # input number for arima forecast of world % vax
-                         dcc.Input(style={'width': '20%', 'backgroundColor': colors['charts'], 'color': colors['text'],
-                                          'border-color': colors['text'], },
-                                   id="numberselect", type="number", placeholder="Forecast", value=50
-                                   ),
-                         # world % vax with arima
-                         dcc.Graph(id='% vax',
-                                   style={'height': 450, 'backgroundColor': colors['charts'], 'color': colors['text']}
-                                   ),
-                     ]),
+            html.Div(id="forecast-row", children=
+            [
+                # select the series to forecast for the selected countries
+                dcc.Dropdown(style={'width': '40%', 'backgroundColor': colors['charts'], 'color': colors['text']},
+                             id='forecastmetricselect',
+                             options=[
+                                 {'label': 'Doses', 'value': 'doses'},
+                                 {'label': 'People Fully Vaccinated', 'value': 'fullvax'},
+                                 {'label': 'Cases', 'value': 'cases'},
+                                 {'label': 'Deaths', 'value': 'deaths'}
+                             ],
+                             value='doses',
+                             clearable=False,
+                             multi=False
+                             ),
+                # country arima forecasts
+                dcc.Graph(id='country_forecast', style={'height': 400, 'width': '100%'}
+                          ),
+                # polls until the country forecasts are ready
+                dcc.Interval(id='country-forecast-poll', interval=5 * 1000),
+            ]),
 
-            html.Div(style={'margin': 5, 'width': "49%", 'justify-content': 'flex-end', 'display': 'inline-block'},
-                     children=
-                     [
-                         # world doses & fully vax
-                         dcc.Graph(id='world_vax',
-                                   style={'height': 245, 'width': "100%", 'backgroundColor': colors['charts'],
-                                          'color': colors['text'], 'display': 'inline-block'}
-                                   ),
-                         # world covid cases & deaths
-                         dcc.Graph(id='world_covid',
-                                   style={'height': 245, 'width': "100%", 'backgroundColor': colors['charts'],
-                                          'color': colors['text'], 'display': 'block'}
-                                   ),
-                     ])
-        ]),
-
-        html.Div(id="filter-container", children=
-        [
-            # below map & scatter. Left side
-            # horizontal rule and Filter title
-            html.Hr(style={'height': 5, 'margin-top': 5, 'margin-bottom': 0, 'backgroundColor': colors['charts'],
-                           'display': 'block'}
+            html.Div(children=
+            [
+                html.H4("DATA:",
+                    style={'text-indent': 30, 'color': colors['text'], 'display': 'block'}
                     ),
-            html.H4("FILTERS",
-                    style={'margin-bottom': 15, 'text-indent': 0, 'color': colors['text'], 'display': 'block'}
+                html.P("COVID-19 Spread:",
+                    style={'text-indent': 30, 'color': colors['text'], 'display': 'inline-block'}
                     ),
-            # select the countries dropdown
-            html.P("Country:", style={'margin-bottom': 0, 'text-indent': 0, 'color': colors['text'], 'display': 'block'}
-                   ),
-            dcc.Dropdown(style={'width': '100%', 'height': 70, 'margin-bottom': 15, 'backgroundColor': colors['charts'],
-                                'color': colors['text'], 'display': 'block'},
-                         id='countryselect',
-                         options=get_options(country_list['country'].unique()),
-                         placeholder="Select a country",
-                         value=['US', 'China', 'Brazil', 'India'],
-                         clearable=False,
-                         multi=True,
-                         ),
-            # select the metric dropdown
-            html.P("Metric:", style={'margin-bottom': 0, 'text-indent': 0, 'color': colors['text'], 'display': 'block'}
-                   ),
-            dcc.Dropdown(style={'width': '100%', 'margin-bottom': 15, 'backgroundColor': colors['charts'],
-                                'color': colors['text'], 'display': 'block'},
-                         id='metricselect',
-                         options=[
-                             {'label': 'Cumulative', 'value': 'Cumulative'},
-                             {'label': 'Daily', 'value': 'Daily'},
-                             {'label': 'Cumulative Per Capita', 'value': 'Cumulative Per Capita'},
-                             {'label': 'Daily Per Capita', 'value': 'Daily Per Capita'}
-                         ],
-                         placeholder="Select a metric",
-                         value='Cumulative',
-                         clearable=False,
-                         multi=False
-                         ),
-            # select the smoothing dropdown
-            html.P("Smoothing:",
-                   style={'margin-bottom': 0, 'text-indent': 0, 'color': colors['text'], 'display': 'block'}
-                   ),
-            dcc.Dropdown(style={'width': '100%', 'backgroundColor': colors['charts'], 'color': colors['text'],
-                                'display': 'block'},
-                         id='smoothselect',
-                         options=[
-                             {'label': 'No Smoothing', 'value': 'No Smoothing'},
-                             {'label': '7 Day Moving Average', 'value': '7 Day Moving Average'},
-                             {'label': '30 Day Moving Average', 'value': '30 Day Moving Average'}
-                         ],
-                         placeholder="Select a smoothing option",
-                         value='No Smoothing',
-                         clearable=False,
-                         multi=False
-                         ),
-        ]),
-
-        html.Div(id="country-grid", children=
-        [
-            # country doses
-            dcc.Graph(id='dose', style={'height': 400, 'width': '100%', 'margin-bottom': 10}
-                      ),
-            # country full vax
-            dcc.Graph(id='fullvax', style={'height': 400, 'width': '100%', 'margin-bottom': 10}
-                      ),
-            # country covid cases
-            dcc.Graph(id='case', style={'height': 400, 'width': '100%'}
-                      ),
-            # country covid deaths
-            dcc.Graph(id='death', style={'height': 400, 'width': '100%', }
-                      ),
-        ]),
-
-        html.Div(children=
-        [
-            html.H4("DATA:",
-                style={'text-indent': 30, 'color': colors['text'], 'display': 'block'}
-                ),
-            html.P("COVID-19 Spread:",
-                style={'text-indent': 30, 'color': colors['text'], 'display': 'inline-block'}
-                ),
-            html.A("CSSE at Johns Hopkins University", href = "https://github.com/CSSEGISandData/COVID-19",
-                style={'text-indent': 5, 'color': '#339966', 'display': 'inline-block'}
-                ),
-        ]),
-
-        html.Div(children=
-        [            
-            html.P("Vaccinations:",
-                style={'text-indent': 30, 'color': colors['text'], 'display': 'inline-block'}
-                ),
-            html.A("Johns Hopkins Centers for Civic Impact", href = "https://github.com/govex/COVID-19",
-                style={'text-indent': 5, 'color': '#339966', 'display': 'inline-block'}
-                ),
-        ]),
-
-    ])
-
+                html.A("CSSE at Johns Hopkins University", href = "https://github.com/CSSEGISandData/COVID-19",
+                    style={'text-indent': 5, 'color': '#339966', 'display': 'inline-block'}
+                    ),
+            ]),
 
-####################################### interactive components #######################################
-# doses chart
-@app.callback(Output('dose', 'figure'),
-              Input('countryselect', 'value'),
-              Input('metricselect', 'value'),
-              Input('smoothselect', 'value'))
-def update_dose(countryselect, metricselect, smoothselect):
-    trace = []
-    df_sub = global_vax_full_df
-    # add lines for each country
-    for country in countryselect:
-        if metricselect == 'Cumulative' and smoothselect == 'No Smoothing':
-            ydata = df_sub[df_sub['country'] == country]['Doses_admin']
-        elif metricselect == 'Cumulative' and smoothselect == '7 Day Moving Average':
-            ydata = df_sub[df_sub['country'] == country]['Doses_admin'].rolling(window=7).sum()
-        elif metricselect == 'Cumulative' and smoothselect == '30 Day Moving Average':
-            ydata = df_sub[df_sub['country'] == country]['Doses_admin'].rolling(window=30).sum()
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == 'No Smoothing':
-            ydata = (df_sub[df_sub['country'] == country]['Doses_admin'] / df_sub[df_sub['country'] == country][
-                'population']) * 100
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == '7 Day Moving Average':
-            ydata = ((df_sub[df_sub['country'] == country]['Doses_admin'] / df_sub[df_sub['country'] == country][
-                'population']) * 100).rolling(window=7).sum()
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == '30 Day Moving Average':
-            ydata = ((df_sub[df_sub['country'] == country]['Doses_admin'] / df_sub[df_sub['country'] == country][
-                'population']) * 100).rolling(window=30).sum()
-        elif metricselect == 'Daily' and smoothselect == 'No Smoothing':
-            ydata = df_sub[df_sub['country'] == country]['Doses_daily']
-        elif metricselect == 'Daily' and smoothselect == '7 Day Moving Average':
-            ydata = df_sub[df_sub['country'] == country]['Doses_daily'].rolling(window=7).sum()
-        elif metricselect == 'Daily' and smoothselect == '30 Day Moving Average':
-            ydata = df_sub[df_sub['country'] == country]['Doses_daily'].rolling(window=30).sum()
-        elif metricselect == 'Daily Per Capita' and smoothselect == 'No Smoothing':
-            ydata = (df_sub[df_sub['country'] == country]['Doses_daily'] / df_sub[df_sub['country'] == country][
-                'population']) * 100
-        elif metricselect == 'Daily Per Capita' and smoothselect == '7 Day Moving Average':
-            ydata = ((df_sub[df_sub['country'] == country]['Doses_daily'] / df_sub[df_sub['country'] == country][
-                'population']) * 100).rolling(window=7).sum()
-        elif metricselect == 'Daily Per Capita' and smoothselect == '30 Day Moving Average':
-            ydata = ((df_sub[df_sub['country'] == country]['Doses_daily'] / df_sub[df_sub['country'] == country][
-                'population']) * 100).rolling(window=30).sum()
-
-        trace.append(go.Scatter(x=df_sub[df_sub['country'] == country]['Date'],
-                                y=ydata,
-                                mode='lines',
-                                opacity=0.7,
-                                name=country,
-                                textposition='bottom center'))
-    traces = [trace]
-    data = [val for sublist in traces for val in sublist]
-    # figure layout
-    figure = {'data': data,
-              'layout': go.Layout(
-                  template='plotly_dark',
-                  plot_bgcolor=colors['charts'],
-                  paper_bgcolor=colors['charts'],
-                  font_color=colors['text'],
-                  margin=dict(l=5, r=7, t=25, b=5),
-                  hovermode='x',
-                  autosize=True,
-                  title={'text': 'Vaccine Doses Administered', 'font_size': 12},
-              ),
-              }
-    return figure
+            html.Div(children=
+            [            
+                html.P("Vaccinations:",
+                    style={'text-indent': 30, 'color': colors['text'], 'display': 'inline-block'}
+                    ),
+                html.A("Johns Hopkins Centers for Civic Impact", href = "https://github.com/govex/COVID-19",
+                    style={'text-indent': 5, 'color': '#339966', 'display': 'inline-block'}
+                    ),
+            ]),
 
+        ])
 
-# fully vax chart
-@app.callback(Output('fullvax', 'figure'),
-              Input('countryselect', 'value'),
-              Input('metricselect', 'value'),
-              Input('smoothselect', 'value'))
-def update_fullvax(countryselect, metricselect, smoothselect):
-    trace = []
-    df_sub = global_vax_full_df
-    # add lines for each country
-    for country in countryselect:
-        if metricselect == 'Cumulative' and smoothselect == 'No Smoothing':
-            ydata = df_sub[df_sub['country'] == country]['People_fully_vaccinated']
-        elif metricselect == 'Cumulative' and smoothselect == '7 Day Moving Average':
-            ydata = df_sub[df_sub['country'] == country]['People_fully_vaccinated'].rolling(window=7).sum()
-        elif metricselect == 'Cumulative' and smoothselect == '30 Day Moving Average':
-            ydata = df_sub[df_sub['country'] == country]['People_fully_vaccinated'].rolling(window=30).sum()
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == 'No Smoothing':
-            ydata = (df_sub[df_sub['country'] == country]['People_fully_vaccinated'] /
-                     df_sub[df_sub['country'] == country]['population']) * 100
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == '7 Day Moving Average':
-            ydata = ((df_sub[df_sub['country'] == country]['People_fully_vaccinated'] /
-                      df_sub[df_sub['country'] == country]['population']) * 100).rolling(window=7).sum()
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == '30 Day Moving Average':
-            ydata = ((df_sub[df_sub['country'] == country]['People_fully_vaccinated'] /
-                      df_sub[df_sub['country'] == country]['population']) * 100).rolling(window=30).sum()
-        elif metricselect == 'Daily' and smoothselect == 'No Smoothing':
-            ydata = df_sub[df_sub['country'] == country]['fully_vaccinated_daily']
-        elif metricselect == 'Daily' and smoothselect == '7 Day Moving Average':
-            ydata = df_sub[df_sub['country'] == country]['fully_vaccinated_daily'].rolling(window=7).sum()
-        elif metricselect == 'Daily' and smoothselect == '30 Day Moving Average':
-            ydata = df_sub[df_sub['country'] == country]['fully_vaccinated_daily'].rolling(window=30).sum()
-        elif metricselect == 'Daily Per Capita' and smoothselect == 'No Smoothing':
-            ydata = (df_sub[df_sub['country'] == country]['fully_vaccinated_daily'] /
-                     df_sub[df_sub['country'] == country]['population']) * 100
-        elif metricselect == 'Daily Per Capita' and smoothselect == '7 Day Moving Average':
-            ydata = ((df_sub[df_sub['country'] == country]['fully_vaccinated_daily'] /
-                      df_sub[df_sub['country'] == country]['population']) * 100).rolling(window=7).sum()
-        elif metricselect == 'Daily Per Capita' and smoothselect == '30 Day Moving Average':
-            ydata = ((df_sub[df_sub['country'] == country]['fully_vaccinated_daily'] /
-                      df_sub[df_sub['country'] == country]['population']) * 100).rolling(window=30).sum()
-
-        trace.append(go.Scatter(x=df_sub[df_sub['country'] == country]['Date'],
-                                y=ydata,
-                                mode='lines',
-                                opacity=0.7,
-                                name=country,
-                                textposition='bottom center'))
-    traces = [trace]
-    data = [val for sublist in traces for val in sublist]
-    # figure layout
-    figure = {'data': data,
-              'layout': go.Layout(
-                  template='plotly_dark',
-                  plot_bgcolor=colors['charts'],
-                  paper_bgcolor=colors['charts'],
-                  font_color=colors['text'],
-                  margin=dict(l=5, r=7, t=25, b=5),
-                  hovermode='x',
-                  autosize=True,
-                  title={'text': 'People Fully Vaccinated', 'font_size': 12},
-              ),
-              }
-    return figure
 
+app.layout = serve_layout
 
-# cases chart
-@app.callback(Output('case', 'figure'),
-              Input('countryselect', 'value'),
-              Input('metricselect', 'value'),
-              Input('smoothselect', 'value'))
-def update_cases(countryselect, metricselect, smoothselect):
-    trace = []
-    # add lines for each country
-    for country in countryselect:
-        if metricselect == 'Cumulative' and smoothselect == 'No Smoothing':
-            ydata = case_y_axis(country)
-        elif metricselect == 'Cumulative' and smoothselect == '7 Day Moving Average':
-            ydata = np.convolve(case_y_axis(country), np.ones(7) / 7, mode='valid')
-        elif metricselect == 'Cumulative' and smoothselect == '30 Day Moving Average':
-            ydata = np.convolve(case_y_axis(country), np.ones(30) / 30, mode='valid')
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == 'No Smoothing':
-            ydata = (case_y_axis(country) / int(pop[pop['country'] == country]['population'])) * 100
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == '7 Day Moving Average':
-            ydata = (np.convolve(case_y_axis(country), np.ones(7) / 7, mode='valid') / int(
-                pop[pop['country'] == country]['population'])) * 100
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == '30 Day Moving Average':
-            ydata = (np.convolve(case_y_axis(country), np.ones(30) / 30, mode='valid') / int(
-                pop[pop['country'] == country]['population'])) * 100
-        elif metricselect == 'Daily' and smoothselect == 'No Smoothing':
-            ydata = case_y_axis(country, 1)
-        elif metricselect == 'Daily' and smoothselect == '7 Day Moving Average':
-            ydata = np.convolve(case_y_axis(country, 1), np.ones(7) / 7, mode='valid')
-        elif metricselect == 'Daily' and smoothselect == '30 Day Moving Average':
-            ydata = np.convolve(case_y_axis(country, 1), np.ones(30) / 30, mode='valid')
-        elif metricselect == 'Daily Per Capita' and smoothselect == 'No Smoothing':
-            ydata = [(i / int(pop[pop['country'] == country]['population'])) * 100 for i in case_y_axis(country, 1)]
-        elif metricselect == 'Daily Per Capita' and smoothselect == '7 Day Moving Average':
-            ydata = np.convolve(
-                [(i / int(pop[pop['country'] == country]['population'])) * 100 for i in case_y_axis(country, 1)],
-                np.ones(7) / 7, mode='valid')
-        elif metricselect == 'Daily Per Capita' and smoothselect == '30 Day Moving Average':
-            ydata = np.convolve(
-                [(i / int(pop[pop['country'] == country]['population'])) * 100 for i in case_y_axis(country, 1)],
-                np.ones(30) / 30, mode='valid')
-
-        trace.append(go.Scatter(x=case_x_data,
-                                y=ydata,
-                                mode='lines',
-                                opacity=0.7,
-                                name=country,
-                                textposition='bottom center'))
-    traces = [trace]
-    data = [val for sublist in traces for val in sublist]
-    # figure layout
-    figure = {'data': data,
-              'layout': go.Layout(
-                  template='plotly_dark',
-                  plot_bgcolor=colors['charts'],
-                  paper_bgcolor=colors['charts'],
-                  font_color=colors['text'],
-                  margin=dict(l=5, r=7, t=25, b=5),
-                  hovermode='x',
-                  autosize=True,
-                  title={'text': 'Covid 19 Cases', 'font_size': 12},
-              ),
-              }
-    return figure
 
+####################################### interactive components #######################################
+# country grid charts: graph id -> (metric table series, x axis attribute, title)
+COUNTRY_CHARTS = {
+    'dose': ('doses', 'vax_x_data', 'Vaccine Doses Administered'),
+    'fullvax': ('fullvax', 'vax_x_data', 'People Fully Vaccinated'),
+    'case': ('cases', 'case_x_data', 'Covid 19 Cases'),
+    'death': ('deaths', 'death_x_data', 'Covid 19 Deaths'),
+}
 
-# deaths chart
-@app.callback(Output('death', 'figure'),
-              Input('countryselect', 'value'),
-              Input('metricselect', 'value'),
-              Input('smoothselect', 'value'))
-def update_deaths(countryselect, metricselect, smoothselect):
-    trace = []
-    # add lines for each country
-    for country in countryselect:
-        if metricselect == 'Cumulative' and smoothselect == 'No Smoothing':
-            ydata = death_y_axis(country)
-        elif metricselect == 'Cumulative' and smoothselect == '7 Day Moving Average':
-            ydata = np.convolve(death_y_axis(country), np.ones(7) / 7, mode='valid')
-        elif metricselect == 'Cumulative' and smoothselect == '30 Day Moving Average':
-            ydata = np.convolve(death_y_axis(country), np.ones(30) / 30, mode='valid')
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == 'No Smoothing':
-            ydata = (death_y_axis(country) / int(pop[pop['country'] == country]['population'])) * 100
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == '7 Day Moving Average':
-            ydata = (np.convolve(death_y_axis(country), np.ones(7) / 7, mode='valid') / int(
-                pop[pop['country'] == country]['population'])) * 100
-        elif metricselect == 'Cumulative Per Capita' and smoothselect == '30 Day Moving Average':
-            ydata = (np.convolve(death_y_axis(country), np.ones(30) / 30, mode='valid') / int(
-                pop[pop['country'] == country]['population'])) * 100
-        elif metricselect == 'Daily' and smoothselect == 'No Smoothing':
-            ydata = death_y_axis(country, 1)
-        elif metricselect == 'Daily' and smoothselect == '7 Day Moving Average':
-            ydata = np.convolve(death_y_axis(country, 1), np.ones(7) / 7, mode='valid')
-        elif metricselect == 'Daily' and smoothselect == '30 Day Moving Average':
-            ydata = np.convolve(death_y_axis(country, 1), np.ones(30) / 30, mode='valid')
-        elif metricselect == 'Daily Per Capita' and smoothselect == 'No Smoothing':
-            ydata = [(i / int(pop[pop['country'] == country]['population'])) * 100 for i in death_y_axis(country, 1)]
-        elif metricselect == 'Daily Per Capita' and smoothselect == '7 Day Moving Average':
-            ydata = np.convolve(
-                [(i / int(pop[pop['country'] == country]['population'])) * 100 for i in death_y_axis(country, 1)],
-                np.ones(7) / 7, mode='valid')
-        elif metricselect == 'Daily Per Capita' and smoothselect == '30 Day Moving Average':
-            ydata = np.convolve(
-                [(i / int(pop[pop['country'] == country]['population'])) * 100 for i in death_y_axis(country, 1)],
-                np.ones(30) / 30, mode='valid')
-
-        trace.append(go.Scatter(x=death_x_data,
-                                y=ydata,
-                                mode='lines',
-                                opacity=0.7,
-                                name=country,
-                                textposition='bottom center'))
-    traces = [trace]
-    data = [val for sublist in traces for val in sublist]
-    # figure layout
-    figure = {'data': data,
-              'layout': go.Layout(
-                  template='plotly_dark',
-                  plot_bgcolor=colors['charts'],
-                  paper_bgcolor=colors['charts'],
-                  font_color=colors['text'],
-                  margin=dict(l=5, r=7, t=25, b=5),
-                  hovermode='x',
-                  autosize=True,
-                  title={'text': 'Covid 19 Deaths', 'font_size': 12},
-              ),
-              }
-    return figure
+# more selected countries than this are drawn with webgl traces
+WEBGL_THRESHOLD = int(os.environ.get('COVID_APP_WEBGL_THRESHOLD', 20))
+# ship the raw series once and apply metric and smoothing in the browser, see assets/clientside.js
+CLIENTSIDE = os.environ.get('COVID_APP_CLIENTSIDE', '') not in ('', '0')
+
+# layout shared by the country grid charts, validated once and only the title changes per chart
+country_grid_layout = go.Layout(
+    template='plotly_dark',
+    plot_bgcolor=colors['charts'],
+    paper_bgcolor=colors['charts'],
+    font_color=colors['text'],
+    margin=dict(l=5, r=7, t=25, b=5),
+    hovermode='x',
+    autosize=True,
+).to_plotly_json()
+
+
+@version_cache()
+def axis_values(ds, x_attr):
+    # dates as plain strings so the json encoder does not visit every timestamp. a copy, the
+    # vaccine dates are mapped from the dataset directory
+    x_data = getattr(ds, x_attr)
+    if isinstance(x_data, pd.DatetimeIndex):
+        return np.asarray(x_data.strftime('%Y-%m-%dT%H:%M:%S'))
+    return np.array(x_data)
+
+
+@version_cache()
+def trace_axis(ds, x_attr, bulk):
+    # x values of the country grid traces. many countries share x0 / dx instead of
+    # repeating every date in each trace
+    axis = daily_axis(pd.to_datetime(getattr(ds, x_attr))) if bulk else None
+    return axis or {'x': axis_values(ds, x_attr)}
+
+
+def flag_trace(ds, series, x_attr, rows, countryselect, values, trace_type):
+    # markers on the flagged days of the selected countries at the value drawn that day, None without any
+    points = selected_flags(ds.flags[series], rows)
+    if not points:
+        return None
+    x_data = axis_values(ds, x_attr)
+    return dict(type=trace_type,
+                x=[x_data[day] for _, day, _ in points],
+                y=[values[position][day] for position, day, _ in points],
+                text=['%s: %s' % (countryselect[position], kind) for position, _, kind in points],
+                mode='markers',
+                marker={'symbol': 'x', 'size': 7, 'color': '#ff6f61'},
+                hovertemplate='%{text}<extra></extra>',
+                name='flagged',
+                showlegend=False)
+
+
+# doses, fully vax, cases & deaths charts in one round trip
+@cached_figure('update_country_grid', figure_version)
+@compact_figures
+def update_country_grid(countryselect, metricselect, smoothselect):
+    ds = current_dataset()
+    # resolve the selected countries and the date axes once for all four charts
+    rows = country_rows(ds, countryselect)
+    bulk = len(countryselect) > WEBGL_THRESHOLD
+    trace_type = 'scattergl' if bulk else 'scatter'
+    figures = []
+    for series, x_attr, title in COUNTRY_CHARTS.values():
+        trace = []
+        values = metric_rows(ds, series, metricselect, smoothselect, rows)
+        # add lines for each country
+        for country, ydata in zip(countryselect, values):
+            trace.append(dict(type=trace_type,
+                              **trace_axis(ds, x_attr, bulk),
+                              y=ydata,
+                              mode='lines',
+                              opacity=0.7,
+                              name=country,
+                              textposition='bottom center'))
+        markers = flag_trace(ds, series, x_attr, rows, countryselect, values, trace_type) if QUALITY_MARKERS else None
+        if markers is not None:
+            trace.append(markers)
+        # figure layout
+        figures.append({'data': trace,
+                        'layout': dict(country_grid_layout, title={'text': title, 'font': {'size': 12}}),
+                        })
+    return figures
+
+
+# cumulative series and populations of the selected countries, the browser derives every metric from them
+@cached_figure('update_country_series', figure_version)
+def update_country_series(countryselect):
+    ds = current_dataset()
+    rows = country_rows(ds, countryselect)
+    bulk = len(countryselect) > WEBGL_THRESHOLD
+    charts = []
+    for series, x_attr, title in COUNTRY_CHARTS.values():
+        charts.append({'title': title,
+                       'axis': trace_axis(ds, x_attr, bulk),
+                       # name of the metrics.py daily transform, mirrored in assets/clientside.js
+                       'daily': SERIES[series].__name__,
+                       'series': metric_rows(ds, series, 'Cumulative', 'No Smoothing', rows),
+                       # (position in countries, day, kind) of the flagged days to mark
+                       'flags': selected_flags(ds.flags[series], rows) if QUALITY_MARKERS else []})
+    return {'countries': countryselect,
+            # countries that are not in the dataset are drawn as zeros, like metric_rows does
+            'known': [row is not None for row in rows],
+            'population': [country_population(ds, country) for country in countryselect],
+            'smoothing': SMOOTHING,
+            'trace_type': 'scattergl' if bulk else 'scatter',
+            'layout': country_grid_layout,
+            'charts': charts}
+
+
+if CLIENTSIDE:
+    app.callback(Output('country-series', 'data'),
+                 Input('countryselect', 'value'))(update_country_series)
+    app.clientside_callback(ClientsideFunction(namespace='clientside', function_name='countryGrid'),
+                            [Output(graph, 'figure') for graph in COUNTRY_CHARTS],
+                            Input('country-series', 'data'),
+                            Input('metricselect', 'value'),
+                            Input('smoothselect', 'value'))
+else:
+    app.callback([Output(graph, 'figure') for graph in COUNTRY_CHARTS],
+                 Input('countryselect', 'value'),
+                 Input('metricselect', 'value'),
+                 Input('smoothselect', 'value'))(update_country_grid)
+
+
+# select all / select region shortcuts fill the country dropdown
+@app.callback(Output('countryselect', 'value'),
+              Input('regionselect', 'value'))
+def select_region(regionselect):
+    if not regionselect:
+        raise PreventUpdate
+    ds = current_dataset()
+    if regionselect == 'all':
+        return list(ds.country_list['country'].unique())
+    return ds.regions.get(regionselect, [])
+
+
+# plotted % vax arrays for the longest horizon, per data version and model
+percentvax_cache = {}
+
+
+def percentvax_arrays(ds, forecast):
+    cache_key = (ds.version, forecast['key'])
+    arrays = percentvax_cache.get(cache_key)
+    if arrays is None:
+        # history dates followed by the forecast dates
+        future = pd.date_range(start=ds.world_vax_ts['Date'].iloc[-1], periods=MAX_HORIZON)[1:]
+        padding = np.full(MAX_HORIZON - 1, np.nan)
+        history = np.full(len(ds.val), np.nan)
+        arrays = {'Date': np.concatenate([ds.world_vax_ts['Date'].to_numpy(), future.strftime("%Y-%m-%d")]),
+                  'Percent_fully_vaccinated': np.concatenate([ds.val, padding]),
+                  'forecast': np.concatenate([history, forecast['mean'][:-1]]),
+                  'upper': np.concatenate([history, forecast['upper'][:-1]]),
+                  'lower': np.concatenate([history, forecast['lower'][:-1]])}
+        percentvax_cache.clear()
+        percentvax_cache[cache_key] = arrays
+    return arrays
 
 
 # % fully vax with arima forecast
 @app.callback(Output('% vax', 'figure'),
-              Input('numberselect', 'value'))
-def update_percentvax(numberselect):
-    # forecast
-    n_periods = numberselect
-    fc, confint = model.predict(n_periods=n_periods, return_conf_int=True)
-    index_of_fc = np.arange(len(val), len(val) + n_periods)
-    # make series for plotting
-    fc_series = pd.Series(fc, index=index_of_fc)
-    lower_series = pd.Series(confint[:, 0], index=index_of_fc)
-    upper_series = pd.Series(confint[:, 1], index=index_of_fc)
-    # add % vax into df
-    fc_ts = pd.DataFrame(world_vax_ts['Date'])
-    fc_ts['Percent_fully_vaccinated'] = val.tolist()
-    # add extra dates for forecast
-    test = pd.DataFrame({'Date': pd.date_range(start=fc_ts.Date.iloc[-1], periods=n_periods)})
-    test = test.iloc[1:, :]
-    test['Date'] = test['Date'].dt.strftime("%Y-%m-%d")
-    # add forecast & conf intervals into df
-    fc_ts = pd.concat([fc_ts, test])
-    fc_ts.reset_index(drop=True, inplace=True)
-    fc_ts['forecast'] = fc_series
-    fc_ts['upper'] = upper_series
-    fc_ts['lower'] = lower_series
-    # add lines to figure
+              Output('model-poll', 'disabled'),
+              Input('numberselect', 'value'),
+              Input('model-poll', 'n_intervals'))
+@compact_figures
+def update_percentvax(numberselect, n_intervals):
+    n_periods = horizon(numberselect)
+    if n_periods is None:
+        raise PreventUpdate
+    ds = current_dataset()
+    forecast = get_forecast(ds.val, name='world_vax')
     figure = go.Figure()
-    figure.add_trace(go.Scatter(x=fc_ts['Date'], y=fc_ts['Percent_fully_vaccinated'], mode='lines', name='% vaccinated',
-                                hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
-    figure.add_trace(go.Scatter(x=fc_ts['Date'], y=fc_ts['forecast'], mode='lines', name='forecast',
-                                hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
-    figure.add_trace(go.Scatter(x=fc_ts['Date'], y=fc_ts['upper'], fill='tonexty', mode='lines', name='upper bound',
-                                hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
-    figure.add_trace(go.Scatter(x=fc_ts['Date'], y=fc_ts['lower'], fill='tonexty', mode='lines', name='lower bound',
-                                hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
+    if forecast is None:
+        # model still fitting in the background, show the history and keep polling
+        figure.add_trace(go.Scatter(x=ds.world_vax_ts['Date'], y=ds.val, mode='lines', name='% vaccinated',
+                                    hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
+        figure.add_annotation(text='Forecast model warming up...', xref='paper', yref='paper', x=0.5, y=0.5,
+                              showarrow=False, font={'size': 14})
+    else:
+        # slice the precomputed forecast down to the requested horizon
+        fc_ts = {column: values[:len(ds.val) + n_periods - 1]
+                 for column, values in percentvax_arrays(ds, forecast).items()}
+        # add lines to figure
+        figure.add_trace(go.Scatter(x=fc_ts['Date'], y=fc_ts['Percent_fully_vaccinated'], mode='lines',
+                                    name='% vaccinated', hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
+        figure.add_trace(go.Scatter(x=fc_ts['Date'], y=fc_ts['forecast'], mode='lines', name='forecast',
+                                    hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
+        figure.add_trace(go.Scatter(x=fc_ts['Date'], y=fc_ts['upper'], fill='tonexty', mode='lines',
+                                    name='upper bound', hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
+        figure.add_trace(go.Scatter(x=fc_ts['Date'], y=fc_ts['lower'], fill='tonexty', mode='lines',
+                                    name='lower bound', hovertemplate='Date: %{x} <br>%{y:.2%}', showlegend=False))
     # figure layout
     figure.update_layout(
         template='plotly_dark',
@@ -832,43 +638,72 @@ def update_percentvax(numberselect):
         autosize=True,
         title={'text': 'Percent of the World Fully Vaccinated', 'font_size': 12},
     )
-    return figure
+    return figure, forecast is not None
+
+
+# country forecast chart
+@app.callback(Output('country_forecast', 'figure'),
+              Output('country-forecast-poll', 'disabled'),
+              Input('countryselect', 'value'),
+              Input('forecastmetricselect', 'value'),
+              Input('numberselect', 'value'),
+              Input('country-forecast-poll', 'n_intervals'))
+@compact_figures
+def update_country_forecast(countryselect, forecastmetricselect, numberselect, n_intervals):
+    n_periods = horizon(numberselect)
+    if n_periods is None:
+        raise PreventUpdate
+    ds = current_dataset()
+    # an ARIMA fit per country, only the first few selected countries are modeled
+    countryselect = countryselect[:MAX_FORECAST_COUNTRIES]
+    x_attr, title = next((x_attr, title) for series, x_attr, title in COUNTRY_CHARTS.values()
+                         if series == forecastmetricselect)
+    x_data = pd.to_datetime(getattr(ds, x_attr))
+    future = pd.date_range(start=x_data[-1], periods=n_periods + 1)[1:]
+    cumulative = metric_rows(ds, forecastmetricselect, 'Cumulative', 'No Smoothing', country_rows(ds, countryselect))
+    trace = []
+    warming = []
+    # history and forecast line for each country
+    for country, ydata in zip(countryselect, cumulative):
+        forecast = country_forecast((country, forecastmetricselect, ds.version), ydata)
+        trace.append(go.Scatter(x=x_data, y=ydata, mode='lines', opacity=0.7, name=country,
+                                legendgroup=country))
+        if forecast is None:
+            warming.append(country)
+        elif 'error' not in forecast:
+            trace.append(go.Scatter(x=future, y=forecast['mean'][:n_periods], mode='lines', opacity=0.7,
+                                    line={'dash': 'dot'}, name=country + ' forecast', legendgroup=country))
+    figure = go.Figure(data=trace)
+    if warming:
+        figure.add_annotation(text='Forecast warming up: ' + ', '.join(warming), xref='paper', yref='paper',
+                              x=0.5, y=0.95, showarrow=False, font={'size': 12})
+    # figure layout
+    figure.update_layout(country_grid_layout)
+    figure.update_layout(title={'text': title + ' Forecast', 'font_size': 12})
+    return figure, not warming
 
 
 # world vaccine chart
 @app.callback(Output('world_vax', 'figure'),
               Input('metricselect', 'value'),
               Input('smoothselect', 'value'))
+@cached_figure('update_world_vax', figure_version)
+@compact_figures
 def update_world_vax(metricselect, smoothselect):
+    ds = current_dataset()
     trace = []
-    # create lines based on metric
-    if (metricselect in ('Cumulative', 'Cumulative Per Capita')) and smoothselect == 'No Smoothing':
-        ydata1 = world_vax_ts['Doses_admin']
-        ydata2 = world_vax_ts['People_fully_vaccinated']
-    elif (metricselect in ('Cumulative', 'Cumulative Per Capita')) and smoothselect == '7 Day Moving Average':
-        ydata1 = world_vax_ts['Doses_admin'].rolling(window=7).sum()
-        ydata2 = world_vax_ts['People_fully_vaccinated'].rolling(window=7).sum()
-    elif (metricselect in ('Cumulative', 'Cumulative Per Capita')) and smoothselect == '30 Day Moving Average':
-        ydata1 = world_vax_ts['Doses_admin'].rolling(window=30).sum()
-        ydata2 = world_vax_ts['People_fully_vaccinated'].rolling(window=30).sum()
-    elif (metricselect in ('Daily', 'Daily Per Capita')) and smoothselect == 'No Smoothing':
-        ydata1 = world_vax_ts['Doses_daily']
-        ydata2 = world_vax_ts['fully_vaccinated_daily']
-    elif (metricselect in ('Daily', 'Daily Per Capita')) and smoothselect == '7 Day Moving Average':
-        ydata1 = world_vax_ts['Doses_daily'].rolling(window=7).sum()
-        ydata2 = world_vax_ts['fully_vaccinated_daily'].rolling(window=7).sum()
-    elif (metricselect in ('Daily', 'Daily Per Capita')) and smoothselect == '30 Day Moving Average':
-        ydata1 = world_vax_ts['Doses_daily'].rolling(window=30).sum()
-        ydata2 = world_vax_ts['fully_vaccinated_daily'].rolling(window=30).sum()
-
-    trace.append(go.Scatter(x=world_vax_ts['Date'],
+    # lines of the selected metric and smoothing from the world table
+    ydata1 = world_values(ds, 'doses', metricselect, smoothselect)
+    ydata2 = world_values(ds, 'fullvax', metricselect, smoothselect)
+
+    trace.append(go.Scatter(x=ds.world_vax_ts['Date'],
                             y=ydata1,
                             mode='lines',
                             line=dict(color="green"),
                             opacity=0.7,
                             name='Doses',
                             textposition='bottom center'))
-    trace.append(go.Scatter(x=world_vax_ts['Date'],
+    trace.append(go.Scatter(x=ds.world_vax_ts['Date'],
                             y=ydata2,
                             mode='lines',
                             line=dict(color="lightgreen"),
@@ -898,36 +733,23 @@ def update_world_vax(metricselect, smoothselect):
 @app.callback(Output('world_covid', 'figure'),
               Input('metricselect', 'value'),
               Input('smoothselect', 'value'))
+@cached_figure('update_world_covid', figure_version)
+@compact_figures
 def update_world_covid(metricselect, smoothselect):
+    ds = current_dataset()
     trace = []
-    # create lines based on metric
-    if (metricselect in ('Cumulative', 'Cumulative Per Capita')) and smoothselect == 'No Smoothing':
-        ydata1 = total_case_y_axis(0)
-        ydata2 = total_death_y_axis(0)
-    elif (metricselect in ('Cumulative', 'Cumulative Per Capita')) and smoothselect == '7 Day Moving Average':
-        ydata1 = np.convolve(total_case_y_axis(0), np.ones(7) / 7, mode='valid')
-        ydata2 = np.convolve(total_death_y_axis(0), np.ones(7) / 7, mode='valid')
-    elif (metricselect in ('Cumulative', 'Cumulative Per Capita')) and smoothselect == '30 Day Moving Average':
-        ydata1 = np.convolve(total_case_y_axis(0), np.ones(30) / 30, mode='valid')
-        ydata2 = np.convolve(total_death_y_axis(0), np.ones(30) / 30, mode='valid')
-    elif (metricselect in ('Daily', 'Daily Per Capita')) and smoothselect == 'No Smoothing':
-        ydata1 = total_case_y_axis(1)
-        ydata2 = total_death_y_axis(1)
-    elif (metricselect in ('Daily', 'Daily Per Capita')) and smoothselect == '7 Day Moving Average':
-        ydata1 = np.convolve(total_case_y_axis(1), np.ones(7) / 7, mode='valid')
-        ydata2 = np.convolve(total_death_y_axis(1), np.ones(7) / 7, mode='valid')
-    elif (metricselect in ('Daily', 'Daily Per Capita')) and smoothselect == '30 Day Moving Average':
-        ydata1 = np.convolve(total_case_y_axis(1), np.ones(30) / 30, mode='valid')
-        ydata2 = np.convolve(total_death_y_axis(1), np.ones(30) / 30, mode='valid')
-
-    trace.append(go.Scatter(x=total_case_x_data,
+    # lines of the selected metric and smoothing from the world table
+    ydata1 = world_values(ds, 'cases', metricselect, smoothselect)
+    ydata2 = world_values(ds, 'deaths', metricselect, smoothselect)
+
+    trace.append(go.Scatter(x=ds.case_x_data,
                             y=ydata1,
                             mode='lines',
                             line=dict(color="red"),
                             opacity=0.7,
                             name='Cases',
                             textposition='bottom center'))
-    trace.append(go.Scatter(x=total_death_x_data,
+    trace.append(go.Scatter(x=ds.death_x_data,
                             y=ydata2,
                             mode='lines',
                             line=dict(color="lightcoral"),
@@ -954,9 +776,12 @@ def update_world_covid(metricselect, smoothselect):
 
 
 # world map chart
-@app.callback(Output('map', 'figure'),
-              Input('dataselect', 'value'))
-def update_world_map(dataselect):
+# the map only depends on dataselect and the data version, every variant is rendered to plain
+# json when a dataset is loaded and the callback returns the stored figure
+map_figures = {}
+
+
+def world_map_figure(ds, dataselect):
     if (
             dataselect == 'Doses_admin' or dataselect == 'People_fully_vaccinated' or dataselect == 'Percent_fully_vaccinated'):
         circle_color = px.colors.sequential.Greens
@@ -973,7 +798,7 @@ def update_world_map(dataselect):
         else:
             name = 'Deaths'
     # create map plot
-    figure = px.scatter_mapbox(full_country_df, lat="lat", lon="long_", color=dataselect, size=dataselect,
+    figure = px.scatter_mapbox(ds.full_country_df, lat="lat", lon="long_", color=dataselect, size=dataselect,
                                size_max=55, hover_name="country", labels={dataselect: 'Total ' + name},
                                color_continuous_scale=circle_color,
                                zoom=1, mapbox_style="carto-darkmatter")
@@ -989,15 +814,38 @@ def update_world_map(dataselect):
     return figure
 
 
+def prerender_maps(ds):
+    figures = {}
+    for dataselect in RANK_COLUMNS:
+        figures[dataselect] = json.loads(json.dumps(world_map_figure(ds, dataselect), cls=PlotlyJSONEncoder))
+    map_figures[ds.version] = figures
+    # keep the previous version for requests that started before the swap
+    while len(map_figures) > 2:
+        map_figures.pop(next(iter(map_figures)))
+
+
+add_swap_hook(prerender_maps)
+
+
+@app.callback(Output('map', 'figure'),
+              Input('dataselect', 'value'))
+def update_world_map(dataselect):
+    ds = current_dataset()
+    figures = map_figures.get(ds.version)
+    if figures is None or dataselect not in figures:
+        return world_map_figure(ds, dataselect)
+    return figures[dataselect]
+
+
 # world vertical bar chart
 @app.callback(Output('bar', 'figure'),
               Input('dataselect', 'value'),
               Input('countrynumberselect', 'value'))
+@cached_figure('update_world_bar', figure_version)
 def update_world_bar(dataselect, countrynumberselect):
-    bar_data = full_country_df.sort_values(dataselect, ascending=False)
+    ds = current_dataset()
     # regular bar chart data
-    bar_data = bar_data.head(countrynumberselect)
-    bar_data = bar_data.iloc[::-1]
+    bar_data = top_countries(ds, dataselect, countrynumberselect).iloc[::-1]
     if (
             dataselect == 'Doses_admin' or dataselect == 'People_fully_vaccinated' or dataselect == 'Percent_fully_vaccinated'):
         bar_color = 'lightgreen'
@@ -1045,22 +893,25 @@ def update_world_bar(dataselect, countrynumberselect):
 # world single total area chart
 @app.callback(Output('world_area', 'figure'),
               Input('dataselect', 'value'))
+@cached_figure('update_world_area', figure_version)
+@compact_figures
 def update_world_area(dataselect):
+    ds = current_dataset()
     if dataselect == 'Doses_admin':
         name = 'Doses'
-        figure = px.area(world_vax_ts, x='Date', y='Doses_admin', color_discrete_sequence=['lightgreen'])
+        figure = px.area(ds.world_vax_ts, x='Date', y='Doses_admin', color_discrete_sequence=['lightgreen'])
     elif dataselect == 'People_fully_vaccinated':
         name = 'People Fully Vaccinated'
-        figure = px.area(world_vax_ts, x='Date', y='People_fully_vaccinated', color_discrete_sequence=['lightgreen'])
+        figure = px.area(ds.world_vax_ts, x='Date', y='People_fully_vaccinated', color_discrete_sequence=['lightgreen'])
     elif dataselect == 'Percent_fully_vaccinated':
         name = 'Percent Fully Vaccinated'
-        figure = px.area(world_vax_ts, x='Date', y='Percent_fully_vaccinated', color_discrete_sequence=['lightgreen'])
+        figure = px.area(ds.world_vax_ts, x='Date', y='Percent_fully_vaccinated', color_discrete_sequence=['lightgreen'])
     elif dataselect == 'confirmed':
         name = 'Cases'
-        figure = px.area(x=total_case_x_data, y=total_case_y_axis(0), color_discrete_sequence=['red'])
+        figure = px.area(x=ds.case_x_data, y=world_values(ds, 'cases'), color_discrete_sequence=['red'])
     elif dataselect == 'deaths':
         name = 'Deaths'
-        figure = px.area(x=total_death_x_data, y=total_death_y_axis(0), color_discrete_sequence=['red'])
+        figure = px.area(x=ds.death_x_data, y=world_values(ds, 'deaths'), color_discrete_sequence=['red'])
 
     # area chart
     figure.update_layout(
@@ -1082,24 +933,28 @@ def update_world_area(dataselect):
 # world single daily area chart
 @app.callback(Output('world_daily', 'figure'),
               Input('dataselect', 'value'))
+@cached_figure('update_world_daily', figure_version)
+@compact_figures
 def update_world_daily(dataselect):
+    ds = current_dataset()
     if dataselect == 'Doses_admin':
         name = 'Doses'
-        figure = px.area(x=world_vax_ts['Date'], y=world_vax_ts['Doses_daily'], color_discrete_sequence=['lightgreen'])
+        figure = px.area(x=ds.world_vax_ts['Date'], y=world_values(ds, 'doses', 'Daily'),
+                         color_discrete_sequence=['lightgreen'])
     elif dataselect == 'People_fully_vaccinated':
         name = 'People Fully Vaccinated'
-        figure = px.area(x=world_vax_ts['Date'], y=world_vax_ts['fully_vaccinated_daily'],
+        figure = px.area(x=ds.world_vax_ts['Date'], y=world_values(ds, 'fullvax', 'Daily'),
                          color_discrete_sequence=['lightgreen'])
     elif dataselect == 'Percent_fully_vaccinated':
         name = 'Percent Fully Vaccinated'
-        figure = px.area(x=world_vax_ts['Date'], y=world_vax_ts['Percent_fully_daily'],
+        figure = px.area(x=ds.world_vax_ts['Date'], y=world_values(ds, 'percentvax', 'Daily'),
                          color_discrete_sequence=['lightgreen'])
     elif dataselect == 'confirmed':
         name = 'Cases'
-        figure = px.area(x=total_case_x_data, y=total_case_y_axis(1), color_discrete_sequence=['red'])
+        figure = px.area(x=ds.case_x_data, y=world_values(ds, 'cases', 'Daily'), color_discrete_sequence=['red'])
     elif dataselect == 'deaths':
         name = 'Deaths'
-        figure = px.area(x=total_death_x_data, y=total_death_y_axis(1), color_discrete_sequence=['red'])
+        figure = px.area(x=ds.death_x_data, y=world_values(ds, 'deaths', 'Daily'), color_discrete_sequence=['red'])
 
     # area chart
     figure.update_layout(
@@ -1122,11 +977,11 @@ def update_world_daily(dataselect):
 @app.callback(Output('stackbar', 'figure'),
               Input('dataselect', 'value'),
               Input('countrynumberselect', 'value'))
+@cached_figure('update_world_stackbar', figure_version)
 def update_world_stackbar(dataselect, countrynumberselect):
-    bar1_data = full_country_df.sort_values(dataselect, ascending=False)
+    ds = current_dataset()
     # stacked bar chart data
-    bar1_data = bar1_data.head(countrynumberselect)
-    bar1_data = bar1_data.iloc[::-1]
+    bar1_data = top_countries(ds, dataselect, countrynumberselect).iloc[::-1]
 
     figure = go.Figure(
         data=[go.Bar(name='Fully',
@@ -1168,7 +1023,9 @@ def update_world_stackbar(dataselect, countrynumberselect):
 @app.callback(Output('scatter1', 'figure'),
               Input('dataselect', 'value'),
               Input('countrynumberselect', 'value'))
+@cached_figure('update_world_scatter', figure_version)
 def update_world_scatter(dataselect, countrynumberselect):
+    ds = current_dataset()
     if (
             dataselect == 'Doses_admin' or dataselect == 'People_fully_vaccinated' or dataselect == 'Percent_fully_vaccinated'):
         if dataselect == 'Doses_admin':
@@ -1183,9 +1040,9 @@ def update_world_scatter(dataselect, countrynumberselect):
         else:
             name = 'Deaths'
     # scatter plot data
-    sorted_country_df = full_country_df.sort_values(dataselect, ascending=False)
+    scatter_data = top_countries(ds, dataselect, countrynumberselect)
     # create scatter plot
-    figure = px.scatter(sorted_country_df.head(countrynumberselect), x="People_fully_vaccinated", y="confirmed",
+    figure = px.scatter(scatter_data, x="People_fully_vaccinated", y="confirmed",
                         size="confirmed", color="country",
                         log_x=True, hover_name="country", size_max=60)
     figure.update_layout(